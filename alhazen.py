@@ -38,20 +38,54 @@ method.
 
 __version__ = "1.4.0"
 
+import asyncio
+import cProfile
 import csv
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import pstats
 import queue
+import random
+import statistics
 import sys
-from collections import defaultdict
+import time
+import traceback
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack, contextmanager
 import logging
-from math import ceil
-from multiprocessing import Process, Queue, log_to_stderr, current_process, cpu_count
+from itertools import count, islice
+from math import ceil, sqrt
+from multiprocessing import Pipe, Process, log_to_stderr, cpu_count
+from multiprocessing.connection import Client, Listener, wait
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from threading import Thread
 from tqdm import tqdm
 from typing import Any, List
 
-TIMEOUT = 0.08
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 DEFAULT_PROCESSOR_COUNT = 4
+LOG_BLOCK_ROWS = 10_000
+COPY_BLOCK_SIZE = 1 << 20
+JOURNAL_SYNC_INTERVAL = 1.0
+TARGET_CHUNK_DURATION = 0.05
+CHUNKS_PER_PROCESS = 4
+STRAGGLER_FACTOR = 2.0
 
 
 class Experiment:
@@ -109,6 +143,160 @@ class Experiment:
     Within the various methods the programmer overrides the log can be written to suing
     the :meth:`log` method.
 
+    Since each worker writes its own log file, and the tasks are distributed among the
+    workers unpredictably, the order of the lines in the resulting log file will vary
+    from one run to the next. If *ordered_log* is true, the output written while running
+    each task is instead placed in order of condition, in the order they appear in
+    :attr:`conditions`, and then of participant. Output written by the control process
+    still comes first, followed by any written by the workers outside of running tasks,
+    such as in :meth:`setup`. This requires the workers to record where in their log files
+    each task's output begins and ends, which is somewhat more expensive for text logs,
+    but does not require reading, parsing or sorting the log itself.
+
+    Text and CSV log files of long running experiments can be very large, but are
+    typically highly redundant, and so compress well. If *log_compression* is ``"gzip"``
+    or ``"lzma"`` the log file is written compressed, in the corresponding format, as by
+    the Python :mod:`gzip` or :mod:`lzma` modules. Each worker compresses its own output
+    as it writes it, so the cost of compression is spread across all the workers, and the
+    resulting log file is simply the concatenation of the compressed streams written by
+    the control process and the workers, which both formats allow, and which is read
+    transparently by :func:`gzip.open`, :func:`lzma.open`, and the usual command line
+    tools. Compression cannot be combined with *ordered_log* or *fieldtypes*.
+
+    Experiments can take many hours to run, and it is disappointing to lose all the work
+    done if one is interrupted before it finishes, whether by the programmer, the
+    operating system or a hardware failure. If *journal* is supplied, it should be the
+    name of a directory, which will be created if necessary, in which the results of
+    tasks are recorded as they are completed, along with the workers' log output, if any,
+    for those tasks. If the experiment is interrupted, a new :class:`Experiment`, of the
+    same class and created with the same arguments, can then be run with this directory
+    supplied as the *resume* argument to :meth:`run` or :meth:`run_iter`, and only the
+    tasks not already recorded as completed will be run. The results of tasks must be
+    `picklable <https://docs.python.org/3.7/library/pickle.html#pickle-picklable>`_ to be
+    recorded in the journal, as they normally must be anyway. Running an
+    :class:`Experiment` with a *journal* but without *resume* discards anything already
+    recorded in that journal. A journal cannot be used with *log_compression*.
+
+    Normally if :meth:`run_participant` raises an exception, or a worker process exits
+    unexpectedly, perhaps killed by the operating system because it was using too much
+    memory, the whole experiment is abandoned. If *retries* is a positive integer, a task
+    that fails in either of these ways is instead run again, possibly in a different
+    worker process, up to that many more times, and only if it fails yet again is the
+    experiment abandoned. A worker process that has exited is replaced by a new one,
+    in which :meth:`setup` is called as usual, and any other tasks that had been sent to
+    it are sent elsewhere. When a worker exits it is not possible to tell which of the
+    tasks in the chunk it was running caused it to do so, so all of them are charged with
+    a failure; tasks that are retried are always sent to workers individually. Note that
+    any log output written by the failed attempts to run a task remains in the log file,
+    unless *ordered_log* is true. When a task has failed more often than *retries* allows,
+    :meth:`participant_failed` is called, which by default abandons the experiment, but
+    which can be overridden to supply a result for the task instead.
+
+    If *task_timeout* is supplied, it should be a positive number of seconds. A worker
+    process that takes longer than that to run a task, or, if tasks are being sent to it
+    in chunks, longer than that times the number of tasks in the chunk, is killed and
+    replaced, and the tasks it was running are treated as having failed, just as if it
+    had exited unexpectedly. Note that the time taken by a chunk is measured from when the
+    worker is expected to have started it, so a very short *task_timeout* may cause tasks
+    to fail spuriously.
+
+    Occasionally a few tasks take far longer than the others, and, once all the other
+    tasks have been completed, the experiment is simply waiting for them. If *speculative*
+    is true, when there are no more tasks to send to a worker that is idle, it is instead
+    sent a copy of whichever chunk has been running longest, provided that has taken
+    more than twice as long as expected from the time taken by the tasks completed so
+    far. Whichever copy completes first is used, and the worker running the other is
+    killed and replaced. This is only useful if the time a task takes varies for reasons
+    other than which participant and condition it is for, for example if it depends on
+    random numbers drawn in the worker. Both copies may write to the log, so their output
+    is duplicated unless *ordered_log* is true.
+
+    If *instrument* is true, a record is kept while the experiment runs of when each task
+    was sent to a worker, when it started and ended there, and when its result was
+    received by the control process, of the sizes of the messages carrying tasks and
+    results, and of how the control process spends its time. A summary of these records
+    is available afterwards as :attr:`instrumentation`, and they can be written in a form
+    that can be displayed graphically with :meth:`write_trace`. This can help in choosing
+    a suitable *process_count*, *chunk_size* and so on, and in spotting when the control
+    process, rather than the workers, limits how fast an experiment runs.
+
+    If *profile* is supplied, it should be the name of a file. Each worker process is
+    then run under the Python `profiler <https://docs.python.org/3/library/profile.html>`_,
+    and when the experiment has finished the statistics collected by all of them are
+    combined and written to that file, which can be read with :class:`pstats.Stats`, or
+    with tools such as `SnakeViz <https://jiffyclub.github.io/snakeviz/>`_. The statistics
+    of a worker that exits unexpectedly or is killed are lost. If *controller_profile* is
+    supplied, the control process is similarly profiled, and its statistics written to
+    that file; note that for :meth:`run_iter` these include any code run while
+    processing the results it yields.
+
+    By default tasks are run in worker processes, but the *executor* can instead be
+    ``"thread"``, in which case the workers are threads of the control process, each
+    using its own shallow copy of the :class:`Experiment`, or ``"inline"``, in which case
+    the control process runs all the tasks itself, one after another, and *process_count*
+    is ignored. In either case the same methods are called as usual, :meth:`setup` once
+    in each thread, or once in the control process. Threads avoid the cost of starting
+    processes, and can share the values set up by :meth:`prepare_experiment`; contexts
+    and results are passed to and from them by reference, without being pickled or
+    copied, so should not be modified once passed. But threads only run tasks in
+    parallel to the extent they release the global interpreter lock, or if a
+    free-threaded build of Python is used; and the threads share the :mod:`random`
+    module, so seeding it for each task when a *cache* is used does not make the tasks'
+    results reproducible. Running inline is useful for debugging, and for experiments
+    too small to benefit from parallelism. Neither supports *task_timeout*,
+    *speculative* or *profile*, though the *controller_profile* of an experiment run
+    inline includes the tasks.
+
+    To use more machines than one, the *executor* can be ``"remote"``. The control
+    process then listens for connections from worker agents on *address*, either a
+    tuple of a host name and a port number, or a string of the form ``"host:port"``, and
+    each agent connecting acts as a worker. The agents, of which there may be any number,
+    on any number of machines, and which may connect at any time while the experiment is
+    running, are started with
+
+    .. code-block:: bash
+
+        python -m alhazen worker host:port --authkey KEY --processes N
+
+    which connects *N* worker processes, by default as many as there are cores, to the
+    control process listening on that host and port. The *authkey*, a string or bytes,
+    must be supplied both to the :class:`Experiment` and to the agents, and is used to
+    authenticate the connections; since what passes through them is pickled, which can
+    run arbitrary code, it should be kept secret, and the port should not be reachable
+    from untrusted networks. The :class:`Experiment` is pickled and sent to each agent
+    when it connects, so its class must be defined in a module the agents can import,
+    not in a script being run as ``__main__``, and any values set up by
+    :meth:`prepare_experiment` must be picklable. Anything the workers log is sent back
+    to the control process when the experiment finishes, and objects published with
+    :meth:`publish` are sent to each agent before it needs them. If an agent disconnects
+    the tasks it was running are retried elsewhere, as if a worker process had exited,
+    but agents are not replaced automatically. If a *cache* is used, the agents see only
+    results cached on their own machine, unless its directory is on a shared file
+    system. The ``"remote"`` executor cannot be used with *journal*,
+    *result_buffer_threshold*, *task_timeout*, *speculative* or *profile*, nor with
+    typed results; and the times recorded by *instrument* are only meaningful if the
+    clocks of the machines involved are synchronized.
+
+    When an experiment is run repeatedly, for example as further conditions are added to
+    a parameter study, many of its tasks may be identical to ones that have been run
+    before. If *cache* is supplied, it should be the name of a directory, which will be
+    created if necessary, in which the result of each task, as returned by
+    :meth:`run_participant`, is saved. Any task whose result is already saved there is
+    not run again, rather the saved result is passed to :meth:`finish_participant`.
+    Such tasks are not sent to workers, and :meth:`prepare_participant` is not called for
+    them, nor :meth:`prepare_condition` if all the tasks in a condition are cached; nor,
+    of course, is anything they would have logged written to the log file. A saved
+    result is identified by the class of the experiment, by *cache_version*, by the
+    participant, by the :func:`repr` of the condition, which should therefore be stable
+    and distinctive, and by the seed returned by :meth:`task_seed`, with which the
+    :mod:`random` module, and NumPy's legacy global random number generator, if NumPy is
+    installed, are seeded before each task is run when a *cache* is used, so that
+    cached results are reproducible. The *cache_version*, by default an empty string,
+    should be changed whenever anything else that could change the results of tasks
+    changes, such as the code run by them, or other parameters of the experiment; a
+    hash of the relevant source files is one possibility. The cache is not cleaned up
+    automatically, so the directory can simply be removed when no longer needed.
+
     It is frequently useful to write log files as Comma Separated Values (CSV) files. The
     *logfile* will effectively be wrapped with a Python :class:`csv.writer` if *csv* is
     not false. If the value of *csv* is `"dict"` that CSV writer will be a `DictWriter
@@ -117,6 +305,110 @@ class Experiment:
     passed to it. If *csv* is false most of those parameters are ignored; the exception is
     *fieldnames* which, if provided, is written as a header in the resulting log file.
 
+    Formatting text, CSV or otherwise, can be a significant part of the cost of running an
+    experiment that logs a great deal, as can parsing it again afterwards. If
+    *fieldtypes* is supplied, the log file is instead written in a compact, binary form,
+    which requires that `NumPy <https://numpy.org/>`_ be installed. In this case
+    *fieldnames* must also be supplied, and *fieldtypes* should be a sequence of the same
+    length, of NumPy data types, or values convertible to them, such as ``int``,
+    ``float`` or ``"U12"``, the types of the corresponding fields. Each call to
+    :meth:`log` should then supply a row, either a sequence of values, in the same order
+    as *fieldnames*, or a dictionary mapping them to values, or, if *multiple* is true,
+    an iterable of such rows. Rows are accumulated in memory, column by column, and
+    written in blocks. The resulting file is a NumPy ``.npy`` file containing a one
+    dimensional structured array with one element per row, which can be read with
+    ``numpy.load``, possibly memory mapped, and easily converted to a
+    `pandas <https://pandas.pydata.org/>`_ ``DataFrame``; it can also be converted to a
+    CSV file with :func:`log_to_csv`. The *csv*, *restval*, *extrasaction* and
+    *dialect* parameters are ignored when *fieldtypes* is supplied.
+
+    By default each task, one participant in one condition, is sent to a worker process
+    individually, and its result returned individually. When there are very many tasks,
+    each of which takes very little time, the cost of this communication can dominate.
+    If *chunk_size* is an integer greater than one, up to that many tasks are instead sent
+    to a worker together, and their results returned together. If *chunk_size* is
+    ``"auto"`` the number of tasks sent together is adjusted as the experiment runs, based
+    on how long the tasks completed so far have taken, aiming for each chunk to take about
+    fifty milliseconds, while still leaving enough chunks to keep all the workers busy.
+    Chunking does not change which methods are called, nor when: :meth:`prepare_participant`,
+    :meth:`finish_participant` and :meth:`finish_condition` are still called once per
+    task or condition, as usual.
+
+    The control process does not prepare all the tasks in advance. Rather it calls
+    :meth:`prepare_participant` for a task only shortly before sending it to a worker,
+    and keeps at most *in_flight* chunks outstanding for each worker at any one time, that
+    is, sent to that worker but with their results not yet returned. This keeps the
+    memory used by the control process for the contexts of tasks roughly constant,
+    however many participants and conditions there are. The default value of *in_flight*,
+    two, lets a worker begin its next chunk as soon as it has finished the previous one,
+    without waiting for the control process. Larger values are rarely useful, but a value
+    of one may be appropriate if contexts are very large.
+
+    The order in which tasks are sent to workers is determined by *schedule*. By default,
+    ``"condition"``, all the participants in the first condition are run, then all those
+    in the second, and so on, so that only one or two conditions are being run at a
+    time, each condition's context is only kept as long as it is needed, and
+    :meth:`finish_condition` is called for each condition as early as possible. If
+    *schedule* is ``"interleave"``, tasks are instead taken from each condition in turn,
+    one participant at a time, so that all the conditions progress together; this
+    requires keeping the contexts of all of them until the end, and all are finished
+    at about the same time, but partial results of every condition are available early,
+    for example from :meth:`run_iter`. When the conditions differ greatly in how long
+    their tasks take, running them in order can leave most workers idle at the end of
+    the experiment, waiting for the last few, long tasks. If *schedule* is
+    ``"longest_first"``, the tasks expected to take longest are sent first, so that the
+    shorter ones fill in around them. How long each task is expected to take is
+    returned by :meth:`task_cost`, which can be overridden to provide an estimate; by
+    default it returns ``None``, in which case one task from each condition is run
+    first, and the remaining conditions are then run one at a time, those whose tasks
+    have been seen to take longest first, the estimates being refined as the experiment
+    progresses.
+
+    Running the same number of participants in every condition can waste effort on
+    conditions whose results vary little, while leaving others too noisy. If
+    *precision* is supplied, it should be a positive number, and *participants* is
+    instead the maximum number of participants run in each condition. As each task is
+    completed the value returned by :meth:`participant_statistic` for its result, by
+    default the result itself, which must then be a number, is accumulated, and once at
+    least *min_participants*, by default ten, have been completed in a condition, and
+    the half width of the *confidence*, by default 95%, confidence interval of the mean
+    of that statistic, using the normal approximation, is no more than *precision*, no
+    further tasks in that condition are sent to the workers. Tasks in it already sent
+    are still completed, and their results included, so the participants run are not
+    necessarily exactly those needed to reach *precision*. Unless *schedule* is
+    ``"longest_first"`` and :meth:`task_cost` is overridden, the participants run in a
+    condition are those numbered from zero up to some number, and in any case
+    :meth:`finish_condition` is passed results only up to the highest numbered
+    participant run, any missing before that being ``None``; how many participants were
+    run in each condition is available as
+    :attr:`participant_counts`. Since individual results are needed, *precision*
+    cannot be used with *reduce*.
+
+    Normally the results of all the participants in a condition are collected in the
+    control process, and held there until they can all be passed together to
+    :meth:`finish_condition`. For experiments with very many participants, or with large
+    results, this can require a great deal of memory. If *reduce* is true the results
+    are instead combined incrementally, as they are produced, using the
+    :meth:`reduce_init`, :meth:`reduce_accumulate`, :meth:`reduce_merge` and
+    :meth:`reduce_finalize` methods, which must then be overridden. The worker processes
+    combine the results of the tasks in each chunk they are sent, and only these
+    partial reductions are returned to the control process, where they are merged.
+    When *reduce* is true :meth:`finish_participant` is not called, and
+    :meth:`finish_condition` is passed the value returned by :meth:`reduce_finalize`
+    instead of a list of results.
+
+    Results are returned from the worker processes to the control process by
+    `pickling <https://docs.python.org/3/library/pickle.html>`_ them and sending them
+    through a pipe, which requires copying them several times. If results contain large
+    buffers, such as big NumPy arrays, this can be slow. If *result_buffer_threshold* is
+    supplied, it should be a positive integer, and any buffer of at least that many bytes
+    in a result that supports `out-of-band pickling
+    <https://docs.python.org/3/library/pickle.html#out-of-band-buffers>`_ is instead
+    written by the worker to a temporary file, which the control process then maps into
+    its memory, so that the corresponding value in the result passed to
+    :meth:`finish_participant` shares memory with that file rather than being copied.
+    A value of about a megabyte is usually a good choice.
+
     """
 
     def __init__(self,
@@ -129,12 +421,36 @@ class Experiment:
                  fieldnames=[],
                  restval="",
                  extrasaction="raise",
-                 dialect="excel"):
+                 dialect="excel",
+                 chunk_size=1,
+                 reduce=False,
+                 result_buffer_threshold=None,
+                 in_flight=2,
+                 fieldtypes=None,
+                 ordered_log=False,
+                 log_compression=None,
+                 journal=None,
+                 retries=0,
+                 task_timeout=None,
+                 speculative=False,
+                 instrument=False,
+                 profile=None,
+                 controller_profile=None,
+                 cache=None,
+                 cache_version="",
+                 executor="process",
+                 address=None,
+                 authkey=None,
+                 schedule="condition",
+                 precision=None,
+                 min_participants=10,
+                 confidence=0.95):
         self._has_been_run = False
         self._participants = participants
         # The following disjunction is in case conditions is an iterator returning no objects;
         # such an iterator is truthy, but results in an empty tuple.
         self._conditions = (tuple(conditions) or (None,)) if conditions else (None,)
+        self._condition_index = {c: i for i, c in enumerate(self._conditions)}
         try:
             avail = cpu_count() or DEFAULT_PROCESSOR_COUNT
         except:
@@ -152,9 +468,39 @@ class Experiment:
             self._process_count = n
         self._show_progress = show_progress
         self._progress = None
-        self._results = {c: [None] * participants for c in self._conditions}
-        self._task_q = Queue()
-        self._result_q = Queue()
+        if not (chunk_size == "auto" or (isinstance(chunk_size, int) and chunk_size >= 1)):
+            raise ValueError(f'chunk_size must be a positive integer or "auto", not {chunk_size}')
+        self._chunk_size = chunk_size
+        self._task_duration = None
+        self._reduce = reduce
+        if result_buffer_threshold is not None and not (
+                isinstance(result_buffer_threshold, int) and result_buffer_threshold >= 1):
+            raise ValueError(f"result_buffer_threshold must be a positive integer, "
+                             f"not {result_buffer_threshold}")
+        self._result_buffer_threshold = result_buffer_threshold
+        if not (isinstance(in_flight, int) and in_flight >= 1):
+            raise ValueError(f"in_flight must be a positive integer, not {in_flight}")
+        self._in_flight = in_flight
+        if schedule not in ("condition", "interleave", "longest_first"):
+            raise ValueError(f'schedule must be "condition", "interleave" or '
+                             f'"longest_first", not {schedule}')
+        self._schedule = schedule
+        self._condition_costs = dict()
+        if precision is not None:
+            if not (isinstance(precision, (int, float)) and precision > 0):
+                raise ValueError(f"precision must be a positive number, not {precision}")
+            if not (isinstance(min_participants, int) and min_participants >= 2):
+                raise ValueError(f"min_participants must be an integer greater than one, "
+                                 f"not {min_participants}")
+            if not 0 < confidence < 1:
+                raise ValueError(f"confidence must be between zero and one, not {confidence}")
+            if reduce:
+                raise RuntimeError("precision cannot be used with reduce")
+        self._precision = precision
+        self._min_participants = min_participants
+        self._confidence = confidence
+        self._condition_completions = None
+        self._results = None
         self._logfile = logfile
         if csv == "dict" and not fieldnames:
             raise RuntimeError('If csv is "dict" than fieldnames must be provided')
@@ -163,9 +509,86 @@ class Experiment:
         self._restval = restval
         self._extrasaction = extrasaction
         self._dialect = dialect
+        if fieldtypes is None:
+            self._log_dtype = None
+        elif np is None:
+            raise RuntimeError("NumPy must be installed to use fieldtypes")
+        elif len(fieldtypes) != len(fieldnames):
+            raise RuntimeError("If fieldtypes is provided fieldnames must be, too, "
+                               "and of the same length")
+        else:
+            self._log_dtype = np.dtype(list(zip(fieldnames, fieldtypes)))
+        self._ordered_log = ordered_log
+        if log_compression not in (None, "gzip", "lzma"):
+            raise ValueError(f'log_compression must be None, "gzip" or "lzma", '
+                             f'not {log_compression}')
+        if log_compression == "lzma" and lzma is None:
+            raise RuntimeError("The lzma module is not available in this Python")
+        if log_compression and (ordered_log or fieldtypes is not None):
+            raise RuntimeError("log_compression cannot be used with ordered_log or fieldtypes")
+        self._log_compression = log_compression
+        self._journal = journal
+        self._journaling = False
+        self._resuming = False
+        if not (isinstance(retries, int) and retries >= 0):
+            raise ValueError(f"retries must be a non-negative integer, not {retries}")
+        self._retries = retries
+        if task_timeout is not None and not (
+                isinstance(task_timeout, (int, float)) and task_timeout > 0):
+            raise ValueError(f"task_timeout must be a positive number, not {task_timeout}")
+        self._task_timeout = task_timeout
+        self._speculative = speculative
+        self._instrument = instrument
+        self._profile = profile
+        self._controller_profile = controller_profile
+        self._controller_profiler = None
+        self._cache = cache
+        self._cache_version = str(cache_version)
+        self._tempdir = None
+        self._published = None
+        if executor not in ("process", "thread", "inline", "remote"):
+            raise ValueError(f'executor must be "process", "thread", "inline" or "remote", '
+                             f'not {executor}')
+        if executor != "process" and (task_timeout is not None or speculative or profile):
+            raise RuntimeError("task_timeout, speculative and profile can only be used "
+                               'with the "process" executor')
+        if executor == "remote":
+            if not (address and authkey):
+                raise RuntimeError('address and authkey must be supplied to use the "remote" '
+                                   'executor')
+            if journal or result_buffer_threshold:
+                raise RuntimeError('journal and result_buffer_threshold cannot be used with '
+                                   'the "remote" executor')
+        self._executor = executor
+        self._address = _parse_address(address) if address else None
+        self._authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        if executor == "inline":
+            self._process_count = 1
+        self._run_finished = None
         self._logwriter = None
+        self._log_file = None
+        self._log_spans = None
         self._logerror_reported = False
 
+    def __getstate__(self):
+        # What the control process uses to keep track of a run, including its open log
+        # file and the results collected so far, is not copied when this object is sent
+        # to a worker process that is spawned rather than forked, or to a remote agent.
+        state = self.__dict__.copy()
+        for name in ("_workers", "_dead_workers", "_copies", "_condition_contexts",
+                     "_task_records", "_chunk_records", "_controller_records",
+                     "_requeued", "_failed", "_attempts", "_settled", "_reductions",
+                     "_statistics", "_outstanding",
+                     "_log_spans", "_log_segments", "_chunk_numbers", "_worker_numbers"):
+            state.pop(name, None)
+        for name in ("_progress", "_log_file", "_logwriter", "_results",
+                     "_controller_profiler"):
+            state[name] = None
+        # published objects the control process has read are read afresh by the worker
+        if state.get("_published") is not None:
+            state["_published"] = dict()
+        return state
+
     @property
     def participants(self):
         """ The number of particpants specified when this :class:`Experiment` was created.
@@ -174,6 +597,17 @@ class Experiment:
         """
         return self._participants
 
+    @property
+    def participant_counts(self):
+        """A dictionary mapping each condition to the number of participants that have
+        been run in it, which, when *precision* has been supplied, may be fewer than
+        :attr:`participants`. This is ``None`` until the :class:`Experiment` has been
+        run.
+        """
+        if self._condition_completions is None:
+            return None
+        return {c: self._condition_completions[c] for c in self._conditions}
+
     @property
     def conditions(self):
         """A tuple containing the conditions specified when this :class:`Experiment` was
@@ -200,6 +634,116 @@ class Experiment:
         """
         return self._show_progress
 
+    @property
+    def instrumentation(self):
+        """ If this :class:`Experiment` was created with *instrument* true, and has been
+        run, a dictionary summarizing where the time went while running it, otherwise
+        ``None``. Times are in seconds, and sizes in bytes. It contains
+
+        * ``"wall_time"``, the time taken by :meth:`run` or :meth:`run_iter` as a whole
+        * ``"tasks"`` and ``"chunks"``, the numbers of each returned by workers
+        * ``"task_time"``, the time spent in :meth:`run_participant`
+        * ``"queue_wait"``, the time between a task being sent to a worker and its starting
+        * ``"return_latency"``, the time between a task ending and its result being
+          received by the control process
+        * ``"bytes_sent"`` and ``"bytes_received"``, the sizes of the messages carrying
+          chunks of tasks to workers, and their results back
+        * ``"export_time"``, the time spent by workers preparing results to be sent
+        * ``"workers"``, a dictionary mapping the name of each worker to a dictionary of
+          the number of tasks it ran, the time it spent running them, ``"busy"``, and the
+          fraction of the time workers were running for which it was busy,
+          ``"utilization"``
+        * ``"controller"``, a dictionary mapping the activities of the control process,
+          ``"prepare"``, ``"wait"``, ``"receive"``, ``"journal"``, ``"complete"``,
+          ``"finish experiment"`` and ``"merge logs"``, to the total time spent on each
+
+        Each of ``"task_time"``, ``"queue_wait"``, ``"return_latency"``, ``"bytes_sent"``,
+        ``"bytes_received"`` and ``"export_time"`` is itself a dictionary of the
+        ``"count"``, ``"total"``, ``"mean"``, ``"median"`` and ``"max"`` of the values
+        recorded.
+        """
+        if not self._instrument or self._run_finished is None:
+            return None
+        tasks = self._task_records
+        chunks = self._chunk_records
+        workers_time = self._run_finished - (self._workers_started or self._run_finished)
+        busy = defaultdict(float)
+        counts = defaultdict(int)
+        for name, _, _, _, start, end, _, _ in tasks:
+            busy[name] += end - start
+            counts[name] += 1
+        controller = defaultdict(float)
+        for name, start, end in self._controller_records:
+            controller[name] += end - start
+        return {
+            "wall_time": self._run_finished - self._run_started,
+            "tasks": len(tasks),
+            "chunks": len(chunks),
+            "task_time": _summarize(end - start for _, _, _, _, start, end, _, _ in tasks),
+            "queue_wait": _summarize(start - sent for _, _, _, sent, start, _, _, _ in tasks),
+            "return_latency": _summarize(received - end
+                                         for _, _, _, _, _, end, received, _ in tasks),
+            "bytes_sent": _summarize(c[4] for c in chunks),
+            "bytes_received": _summarize(c[5] for c in chunks),
+            "export_time": _summarize(c[6] for c in chunks),
+            "workers": {name: {"tasks": counts[name],
+                               "busy": busy[name],
+                               "utilization": (busy[name] / workers_time
+                                               if workers_time > 0 else 0.0)}
+                        for name in sorted(busy)},
+            "controller": dict(controller)}
+
+    def write_trace(self, path):
+        """ Writes the records kept while running this :class:`Experiment`, which must
+        have been created with *instrument* true, to a file named *path*, as JSON in the
+        `Trace Event Format
+        <https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU/>`_,
+        which can be displayed by `Perfetto <https://ui.perfetto.dev/>`_, or by
+        ``chrome://tracing`` in Chrome. Each worker is shown as a thread, running its
+        tasks, and the control process as a further thread, showing how it spends its time.
+        """
+        if not self._instrument or self._run_finished is None:
+            raise RuntimeError("Only an Experiment created with instrument true, and "
+                               "which has been run, can write a trace")
+        origin = self._run_started
+        def micros(t):
+            return round((t - origin) * 1_000_000, 1)
+        threads = {"control process": 0}
+        for name, *_ in self._task_records:
+            threads.setdefault(name, len(threads))
+        events = [{"name": "thread_name", "ph": "M", "pid": 0, "tid": tid,
+                   "args": {"name": name}}
+                  for name, tid in threads.items()]
+        for name, p, c, sent, start, end, received, failed in self._task_records:
+            events.append({"name": f"participant {p}", "cat": "task", "ph": "X",
+                           "pid": 0, "tid": threads[name],
+                           "ts": micros(start), "dur": micros(end) - micros(start),
+                           "args": {"participant": p, "condition": str(c),
+                                    "queue_wait": micros(start) - micros(sent),
+                                    "return_latency": micros(received) - micros(end),
+                                    "failed": failed}})
+        for name, start, end in self._controller_records:
+            events.append({"name": name, "cat": "control", "ph": "X", "pid": 0, "tid": 0,
+                           "ts": micros(start), "dur": micros(end) - micros(start)})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    @property
+    def chunk_size(self):
+        """The maximum number of tasks sent to a worker process at one time, or ``"auto"``
+        if that number is adjusted as the experiment runs. This is a read only attribute
+        and cannot be modified after the :class:`Experiment` is created.
+        """
+        return self._chunk_size
+
+    @property
+    def schedule(self):
+        """The order in which tasks are sent to the workers, ``"condition"``,
+        ``"interleave"`` or ``"longest_first"``. This is a read only attribute and cannot
+        be modified after the :class:`Experiment` is created.
+        """
+        return self._schedule
+
     def prepare_experiment(self, **kwargs):
        """The control process calls this method, once, before any of the other methods in
        the public API. If any keyword arguments were passed to to :class:`Experiment`'s
@@ -228,6 +772,8 @@ class Experiment:
         method may write information that it wishes to pass to the task in the worker
         processes. Information added to the *context* must be
         `picklable <https://docs.python.org/3.7/library/pickle.html#pickle-picklable>`_.
+        The *context* is sent to each worker process just once, not with every task, so
+        it is a good place for large values used by all the participants in a condition.
         This method is intended to be overridden in subclasses, and should not be called
         directly by the programmer. The default implementation of this method does
         nothing.
@@ -245,7 +791,11 @@ class Experiment:
         :meth:`prepare_condition`, which is called before any calls to this method for a
         particular *condition*. The *context* passed to this method is a fresh copy of
         that potentially modified by :meth:`prepare_condition`, and does not contain any
-        modifications made by earlier calls to :meth:`prepare_participant`. This method is
+        modifications made by earlier calls to :meth:`prepare_participant`. Only the
+        entries this method adds, replaces or removes are sent to the worker with the task,
+        the rest of the *context* having been sent there already, so this method should
+        not modify in place the values placed in the *context* by
+        :meth:`prepare_condition`, though it may replace them. This method is
         intended to be overridden in subclasses, and should not be called directly by the
         programmer. The default implementation of this method does nothing.
 
@@ -309,7 +859,109 @@ class Experiment:
         """
         return results
 
-    def run(self, **kwargs):
+    def participant_failed(self, participant, condition, description):
+        """ The control process calls this method when the task for *participant* in
+        *condition* has failed, and cannot be retried, because *retries* attempts have
+        already been made to do so. The *description* is a string describing the most
+        recent failure, including the traceback if :meth:`run_participant` raised an
+        exception. By default this method raises a :exc:`RuntimeError`, which causes the
+        experiment to be abandoned. It can be overridden to instead return a value that
+        is used as the result of the task, as if it had been returned by
+        :meth:`run_participant`, for example a sentinel value recording the failure, so
+        that the experiment can continue. Such a result is not recorded in the *journal*,
+        if any, so the task is attempted again if the experiment is resumed.
+        """
+        raise RuntimeError(description)
+
+    def task_seed(self, participant, condition):
+        """ Returns an integer, derived deterministically from *participant* and the
+        :func:`repr` of *condition*, suitable for seeding random number generators so that
+        the task for that participant in that condition produces the same result every
+        time it is run, no matter which worker process runs it. When a *cache* is used,
+        this is called in the worker process before each task is run, to seed the
+        :mod:`random` module, and NumPy's legacy global random number generator, if NumPy
+        is installed. It may also be called by :meth:`run_participant` to seed any other
+        random number generators it uses. It may be overridden, for example to mix in a
+        seed for the experiment as a whole.
+        """
+        digest = hashlib.sha256(f"{condition!r}\0{participant}".encode()).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def participant_statistic(self, participant, condition, result):
+        """ When the :class:`Experiment` was created with *precision*, the control
+        process calls this method with each *result* as returned by
+        :meth:`finish_participant`, and it should return a number, the statistic whose
+        mean in *condition* is to be estimated to within *precision*, or ``None`` if this
+        *result*, for example one supplied by :meth:`participant_failed`, should not
+        contribute to it. This method is intended to be overridden in subclasses, and
+        should not be called directly by the programmer. The default implementation of
+        this method returns *result* unchanged.
+        """
+        return result
+
+    def task_cost(self, participant, condition):
+        """ When the :class:`Experiment` was created with *schedule* ``"longest_first"``,
+        the control process calls this method for each task before any are sent to the
+        workers, and sends them in decreasing order of the numbers it returns, which
+        should be proportional to how long the task for *participant* in *condition* is
+        expected to take, for example the number of rounds or the size of the model it
+        uses. If it returns ``None``, as the default implementation of this method does,
+        for the first task, it is not called for any others, and the relative costs of
+        the conditions are instead learned from the time their tasks take as the
+        experiment runs. This method is intended to be overridden in subclasses, and
+        should not be called directly by the programmer.
+        """
+        return None
+
+    def reduce_init(self, condition):
+        """When the :class:`Experiment` was created with *reduce* true, this method is
+        called, possibly in either the control process or a worker process, to create a
+        fresh, empty partial reduction of the results of tasks in the given *condition*.
+        The value returned must be
+        `picklable <https://docs.python.org/3.7/library/pickle.html#pickle-picklable>`_.
+        This method is intended to be overridden in subclasses, and should not be called
+        directly by the programmer. The default implementation of this method returns
+        ``None``.
+        """
+        return None
+
+    def reduce_accumulate(self, partial, participant, condition, result):
+        """When the :class:`Experiment` was created with *reduce* true, this method is
+        called in a worker process after each participant's task has been completed.
+        Passed as *partial* is a partial reduction for the *condition*, either created by
+        :meth:`reduce_init` or returned by a previous call to this method, and as
+        *result* the value returned by :meth:`run_participant`. It should return a new
+        partial reduction combining these, or may modify *partial* and return it. This
+        method must be overridden by subclasses using reduction, and should not be called
+        directly by the programmer. The default implementation of this method raises a
+        :exc:`NotImplementedError`.
+        """
+        raise NotImplementedError("The reduce_accumulate() method must be overridden")
+
+    def reduce_merge(self, partial, other):
+        """When the :class:`Experiment` was created with *reduce* true, this method is
+        called in the control process to combine two partial reductions, *partial* and
+        *other*, for the same condition. It should return a new partial reduction
+        combining them, or may modify *partial* and return it. Since the order in which
+        partial reductions arrive from the worker processes is not predictable, this
+        combination should be associative and commutative. This method must be overridden
+        by subclasses using reduction, and should not be called directly by the
+        programmer. The default implementation of this method raises a
+        :exc:`NotImplementedError`.
+        """
+        raise NotImplementedError("The reduce_merge() method must be overridden")
+
+    def reduce_finalize(self, condition, partial):
+        """When the :class:`Experiment` was created with *reduce* true, this method is
+        called in the control process once all the tasks in *condition* have been
+        completed, and passed the complete reduction of their results. The value it
+        returns is passed to :meth:`finish_condition`. This method is intended to be
+        overridden in subclasses, and should not be called directly by the programmer.
+        The default implementation of this method returns *partial* unchanged.
+        """
+        return partial
+
+    def run(self, *, resume=None, **kwargs):
         """This method is called by the programmer to begin processing of the various
         tasks of this :class:`Experiment`. It creates one or more worker processes, and
         partitions tasks between them ensuring that one, and exactly one, worker process
@@ -321,25 +973,192 @@ class Experiment:
         keyword arguments are supplied when calling :meth:`run` they are passed to the
         :class:`Experiment`'s :meth:`prepare_experiment` method. Returns the value
         returned by the :meth:`finish_experiment` method, or ``None``.
+
+        If *resume* is supplied it should be the name of a journal directory written by an
+        earlier, interrupted run of an :class:`Experiment` of the same class, with the same
+        participants and conditions, as described for the *journal* parameter when
+        creating the :class:`Experiment`. The tasks recorded there as completed are not
+        run again; rather their results are read from the journal and passed to
+        :meth:`finish_participant` just as if they had been freshly completed, before any
+        further tasks are run. The results of the further tasks are also recorded in the
+        journal, so an experiment can be resumed repeatedly, until it finishes.
+        """
+        for _ in self._synchronously(self._execute(kwargs, True, resume)):
+            pass
+        return self._run_result()
+
+    def _run_result(self):
+        # The value returned by run() and run_async().
+        if self._results is None or self._conditions != (None,):
+            return self._results
+        return self._results[None]
+
+    def run_iter(self, *, resume=None, **kwargs):
+        """This method is an alternative to :meth:`run`, for experiments whose results are
+        too voluminous to be conveniently held in the control process all at once. It is a
+        generator which runs the experiment just as :meth:`run` does, but yields a tuple
+        of the form ``(condition, participant, result)`` as soon as each participant's
+        task has been completed and :meth:`finish_participant` called on it, *result*
+        being the value returned by :meth:`finish_participant`. These results are not
+        retained by the :class:`Experiment` once they have been yielded. Since the results
+        are not retained, :meth:`finish_condition` and :meth:`finish_experiment` are not
+        called. If the :class:`Experiment` was created with *reduce* true, a tuple of the
+        form ``(condition, None, result)`` is instead yielded once for each condition,
+        *result* being the value returned by :meth:`reduce_finalize`. The results are yielded in the order in which they are completed, which
+        will typically not be the order in which the tasks were begun. Any keyword
+        arguments are passed to :meth:`prepare_experiment`, and *resume* is interpreted,
+        as for :meth:`run`; the results of any tasks read from a journal are yielded
+        first. If the
+        generator is closed before it has been exhausted, for example by breaking out of a
+        loop over it, the worker processes are stopped and the experiment abandoned.
+        """
+        yield from self._synchronously(self._execute(kwargs, False, resume))
+
+    async def run_async(self, *, resume=None, **kwargs):
+        """A coroutine which runs the experiment just as :meth:`run` does, returning the
+        same value, but which, rather than blocking while waiting for the workers, waits
+        for them using the running :mod:`asyncio` event loop, so that other tasks,
+        including other experiments, can make progress meanwhile. The methods of the
+        :class:`Experiment` called in the control process, such as
+        :meth:`finish_participant`, are still called in the event loop's thread, so should
+        not take long; but waiting for the workers to exit at the end, and merging their
+        logs, is done in the loop's default executor. If the coroutine is cancelled the
+        worker processes are stopped and the experiment abandoned. On Windows, whose
+        default event loop cannot wait for pipes directly, a thread is used to wait for
+        the workers instead.
         """
+        async for _ in self._asynchronously(self._execute(kwargs, True, resume)):
+            pass
+        return self._run_result()
+
+    async def run_async_iter(self, *, resume=None, **kwargs):
+        """An asynchronous generator, which is to :meth:`run_async` as :meth:`run_iter`
+        is to :meth:`run`, yielding the same values as :meth:`run_iter` as tasks are
+        completed, for use with ``async for``. If it is closed before it has been
+        exhausted, or the task iterating over it cancelled, the worker processes are
+        stopped and the experiment abandoned.
+        """
+        async for result in self._asynchronously(self._execute(kwargs, False, resume)):
+            yield result
+
+    def _synchronously(self, execution):
+        # Drives the generator execution returned by _execute(), yielding the results it
+        # yields, waiting, by blocking, when it asks to wait for workers, and making the
+        # calls it asks to have made. Any exception, such as a KeyboardInterrupt, raised
+        # while waiting or calling is passed on to it.
+        ready = error = None
+        try:
+            while True:
+                try:
+                    item = execution.throw(error) if error else execution.send(ready)
+                except StopIteration:
+                    return
+                ready = error = None
+                if isinstance(item, (_Wait, _Call)):
+                    try:
+                        if isinstance(item, _Wait):
+                            ready = wait(item.objects, item.timeout)
+                        else:
+                            ready = item.function(*item.args)
+                    except (Exception, KeyboardInterrupt) as e:
+                        error = e
+                else:
+                    yield item
+        finally:
+            execution.close()
+
+    async def _asynchronously(self, execution):
+        # The asynchronous counterpart of _synchronously(), waiting in the event loop,
+        # and making the calls asked for in the loop's default executor.
+        loop = asyncio.get_running_loop()
+        ready = error = None
+        try:
+            while True:
+                try:
+                    item = execution.throw(error) if error else execution.send(ready)
+                except StopIteration:
+                    return
+                ready = error = None
+                if isinstance(item, (_Wait, _Call)):
+                    try:
+                        if isinstance(item, _Wait):
+                            ready = await _wait_async(loop, item.objects, item.timeout)
+                        else:
+                            ready = await loop.run_in_executor(None, item.function,
+                                                               *item.args)
+                    except Exception as e:
+                        error = e
+                else:
+                    yield item
+        finally:
+            # if cancelled, this stops the workers
+            execution.close()
+
+    def _execute(self, kwargs, keep, resume=None):
+        # The machinery underlying both run() and run_iter(). A generator yielding a tuple
+        # (condition, participant, result) as each task is completed. If keep is true the
+        # results are also accumulated in self._results and finish_condition() and
+        # finish_experiment() called on them as appropriate. If resume is the name of a
+        # journal directory the tasks recorded in it are replayed rather than run.
         # note that Alhazen logs are unrelated to Python logging with logger
         logger = log_to_stderr()
         if self._has_been_run:
             raise RuntimeError(f"This Experiment has already been run")
         self._has_been_run = True
-        total_tasks = self._participants * len(self._conditions)
+        self._total_tasks = self._participants * len(self._conditions)
+        self._tasks_completed = 0
+        self._condition_completions = defaultdict(int)
+        self._condition_sizes = dict()
+        self._condition_extents = defaultdict(int)
+        self._outstanding = defaultdict(int)
+        self._statistics = dict()
+        self._reductions = dict()
+        self._condition_contexts = dict()
+        self._log_spans = [] if self._ordered_log and self._logfile else None
+        self._run_started = time.time()
+        self._run_finished = None
+        self._workers_started = None
+        self._task_records = []
+        self._chunk_records = []
+        self._controller_records = []
+        agents = None
         tempdir = None
         logfile = None
         logwriter = None
-        processes = []
+        journal = None
+        self._workers = []
+        self._dead_workers = []
         try:
+            if self._controller_profile:
+                self._controller_profiler = cProfile.Profile()
+                self._controller_profiler.enable()
+            if resume or self._journal:
+                if self._log_compression:
+                    raise RuntimeError("A journal cannot be used with log_compression")
+                journal = _Journal(resume or self._journal, bool(resume))
+            self._journaling = bool(journal)
+            self._resuming = bool(resume)
+            self._allocate_results(keep)
             tempdir = TemporaryDirectory(prefix="alhazen-")
             self._tempdir = tempdir.name
-            processes = [ Process(target=self._run_one, name=f"worker-{i:04d}")
-                          for i in range(self._process_count) ]
+            self._published = dict()
+            # When journaling, the workers' logs are kept with the journal, and named
+            # distinctly for this run, so they are still available if it is interrupted.
+            self._log_dir = journal.directory if journal else self._tempdir
+            self._log_prefix = f"{journal.run}-" if journal else ""
+            self._log_segments = dict()
+            done = set()
+            if self._executor == "remote":
+                agents = _Agents(self._address, self._authkey)
+            elif self._executor != "inline":
+                self._workers = [ _Worker(self, f"worker-{i:04d}")
+                                  for i in range(self._process_count) ]
             if self._logfile:
-                logfile = self._open_log(self._logfile)
-            if logfile:
+                # A binary log cannot be written in place until the total number of rows
+                # is known, so the control process writes to a temporary file, too.
+                logfile = self._open_log(self._logfile if self._log_dtype is None
+                                         else Path(self._tempdir, "controller"))
+            if logfile and self._log_dtype is None:
                 if self._fieldnames:
                     if self._csv == "dict":
                         self._logwriter.writeheader()
@@ -348,91 +1167,895 @@ class Experiment:
                     else:
                         self.log(",".join(self._fieldnames))
             self.prepare_experiment(**kwargs)
-            for p in processes:
-                p.start()
-            tasks = ((c, p) for c in self._conditions for p in range(self._participants))
-            tasks_completed = 0
-            condition_completions = defaultdict(int)
-            self._progress = self._show_progress and tqdm(total=total_tasks)
-            condition_context = None
-            current_condition = None
-            participant = None
-            blocking = False
+            self._progress = self._show_progress and tqdm(total=self._total_tasks)
             self._prgrogress = None
-            while tasks_completed < total_tasks:
-                did_something = False
-                if participant is None:
-                    try:
-                        condition, participant = next(tasks)
-                    except StopIteration:
-                        participant = None
-                if participant is not None:
-                    if not condition_context or condition != current_condition:
-                        condition_context = dict()
-                        current_condition = condition
-                        self.prepare_condition(condition, condition_context)
-                    participant_context = dict(condition_context)
-                    self.prepare_participant(participant, condition, participant_context)
-                    try:
-                        self._task_q.put((participant, condition, participant_context), blocking, TIMEOUT)
-                        participant = None
-                    except queue.Full:
-                        pass
-                    did_something = True
-                while True:
+            for log_name, log_position, spans, chunk, results, partials in (
+                    journal.replay() if journal else ()):
+                done.update(chunk)
+                if log_name:
+                    self._log_segments[log_name] = (Path(journal.directory, log_name),
+                                                    log_position)
+                if spans and self._log_spans is not None:
+                    self._log_spans.extend((self._condition_index[c], p, log_name, *s)
+                                           for p, c, *s in spans)
+                yield from self._completed(results, partials, None, keep)
+            self._worker_numbers = count(len(self._workers))
+            self._workers_started = time.time()
+            for w in self._workers:
+                self._log_segments[w.log_name] = (Path(self._log_dir, w.log_name), None)
+                w.start()
+            if self._cache:
+                yield from self._cached_results(done, keep)
+            tasks = self._prepared_tasks(done)
+            self._attempts = defaultdict(int)
+            self._requeued = deque()
+            self._failed = deque()
+            self._chunk_numbers = count()
+            self._copies = dict()
+            self._settled = set()
+            if self._executor == "inline":
+                yield from self._run_inline(tasks, journal, logfile, keep)
+            while self._tasks_completed < self._total_tasks:
+                for w in self._workers:
+                    while len(w.in_flight) < self._in_flight:
+                        with self._timed("prepare"):
+                            chunk = self._next_chunk(
+                                tasks, self._total_tasks - self._tasks_completed)
+                        if not chunk:
+                            break
+                        try:
+                            self._send(w, chunk, next(self._chunk_numbers))
+                        except OSError:
+                            # it has exited or disconnected, as will be noticed shortly
+                            break
+                    if self._speculative and not w.in_flight:
+                        self._speculate(w)
+                with self._timed("wait"):
+                    ready = yield _Wait([w.readable for w in self._workers]
+                                        + [w.process.sentinel for w in self._workers
+                                           if w.process.sentinel is not None]
+                                        + ([agents.arrived] if agents else []),
+                                        self._next_deadline())
+                for w in list(self._workers):
+                    if w not in self._workers:
+                        # replaced while handling the results of another worker
+                        continue
+                    # Results are read before noticing a worker has exited, in case it
+                    # sent some just before doing so.
+                    lost = False
                     try:
-                        p, c, result, err = self._result_q.get(blocking, TIMEOUT)
-                        if err:
-                            raise RuntimeError(f"Exception in {err}")
-                        self._results[c][p] = self.finish_participant(p, c, result)
-                        tasks_completed += 1
-                        condition_completions[c] += 1
-                        assert condition_completions[c] <= self._participants
-                        if condition_completions[c] == self._participants:
-                            self._results[c] = self.finish_condition(c, self._results[c])
-                        did_something = True
-                        if self._progress:
-                            self._progress.update()
-                    except queue.Empty:
-                        break
-                blocking = not did_something
-            for i in range(len(processes)):
-                self._task_q.put((None, None, None))
-            self._results = self.finish_experiment(self._results)
-            for p in processes:
-                p.join()
-            if logfile:
-                for p in processes:
-                    for line in open(Path(self._tempdir, p.name)):
-                        logfile.write(line)
-            return self._results if self._conditions != (None,) else self._results[None]
-        except KeyboardInterrupt:
-            for p in processes:
+                        while ((w.readable in ready or w.process.sentinel in ready)
+                               and w.results.poll()):
+                            with self._timed("receive"):
+                                message = w.receive()
+                            if message[0] is None:
+                                # it has finished setup()
+                                w.set_ready()
+                                continue
+                            yield from self._chunk_returned(w, message, journal, logfile, keep)
+                    except (EOFError, OSError):
+                        # it died while sending, or, if remote, has disconnected
+                        lost = True
+                    if w.process.sentinel in ready or (lost and w.process.sentinel is None):
+                        self._worker_died(w)
+                if agents and agents.arrived in ready:
+                    for connection in agents.accepted():
+                        w = _Worker(self, f"worker-{next(self._worker_numbers):04d}",
+                                    connection)
+                        self._log_segments[w.log_name] = (Path(self._log_dir, w.log_name),
+                                                          None)
+                        self._workers.append(w)
+                        w.start()
+                self._check_timeouts()
+                yield from self._completed_failures(keep)
+            for w in self._workers:
                 try:
-                    p.terminate()
-                except:
+                    w.send(None)
+                except OSError:
+                    # it has already exited, or disconnected, with nothing left to do
                     pass
+            if keep:
+                with self._timed("finish experiment"):
+                    self._results = self.finish_experiment(self._results)
+            # These may take a while, and so, when run by run_async(), are run in another
+            # thread, so as not to hold up the event loop.
+            yield _Call(self._join, self._workers + self._dead_workers)
+            if self._profile:
+                yield _Call(self._merge_profiles)
+            if logfile:
+                with self._timed("merge logs"):
+                    yield _Call(self._merge_logs, logfile, self._log_segments)
+        except KeyboardInterrupt:
+            for w in self._workers:
+                w.terminate()
             sys.exit(2)
+        except GeneratorExit:
+            for w in self._workers:
+                w.terminate()
+            raise
         except:
             logging.exception("Exception in Alhazen control process")
-            for p in processes:
-                try:
-                    p.terminate()
-                except:
-                    pass
+            self._results = None
+            for w in self._workers:
+                w.terminate()
         finally:
             try:
-                self._result_q.close()
-                self._task_q.close()
+                if self._controller_profiler:
+                    self._controller_profiler.disable()
+                    self._controller_profiler.dump_stats(self._controller_profile)
+                    self._controller_profiler = None
+                if agents:
+                    agents.close()
+                for w in self._workers + self._dead_workers:
+                    w.close()
                 if self._progress:
                     self._progress.close()
                 if logfile:
                     logfile.close()
+                if journal:
+                    journal.close()
                 if tempdir:
                     tempdir.cleanup()
+                    self._tempdir = None
+                self._release_results()
+                self._run_finished = time.time()
             except:
                 logging.exception("Exception cleaning up Alhazen control process")
 
+    def _merge_profiles(self):
+        # Called in the control process, once the workers have finished, to combine the
+        # statistics written by their profilers into a single file.
+        paths = sorted(Path(self._tempdir).glob("*.prof"))
+        if not paths:
+            logging.warning("No profiling statistics were written by the workers")
+            return
+        pstats.Stats(*map(str, paths)).dump_stats(self._profile)
+
+    def _next_chunk(self, tasks, remaining):
+        # Called in the control process to assemble the next chunk of tasks to send to a
+        # worker. Tasks that are being retried are sent first, and individually, so that
+        # if they fail again they do not take other tasks with them.
+        if self._requeued:
+            return [self._requeued.popleft()]
+        return list(islice(tasks, self._next_chunk_size(remaining)))
+
+    def _chunk_returned(self, worker, message, journal, logfile, keep):
+        # Called in the control process with a message from a worker reporting the
+        # results of the oldest chunk it has been sent. A generator yielding the same
+        # values as _completed().
+        (payload, spans, log_position, duration, failures, timings, err), size = message
+        if err:
+            raise RuntimeError(f"Exception in {err}")
+        number, chunk = worker.received()
+        dispatched = worker.dispatched.pop(number)
+        if timings:
+            self._record_chunk(worker.name, chunk, dispatched, size, failures, timings)
+        if number in self._copies:
+            # A speculative copy of this chunk was sent to another worker; only the first
+            # result to arrive is used, and a copy still running elsewhere is abandoned.
+            others = self._copies[number]
+            others.discard(worker)
+            if number in self._settled:
+                self._drop_copies(number)
+                self._discard(payload)
+                return
+            self._settled.add(number)
+            for w in list(others):
+                if w.in_flight[0][0] == number:
+                    self._replace_worker(w)
+            self._drop_copies(number)
+        with self._timed("receive"):
+            results, partials = self._import(payload)
+        yield from self._chunk_completed(worker.name, worker.log_name, chunk, results,
+                                         partials, spans, log_position, duration, failures,
+                                         journal, logfile, keep)
+
+    def _chunk_completed(self, name, log_name, chunk, results, partials, spans,
+                         log_position, duration, failures, journal, logfile, keep):
+        # Called in the control process with the outcome of running a chunk of tasks in
+        # the worker called name, whose log is log_name. Failed tasks are retried, and the
+        # others recorded in the journal, if any, and completed. A generator yielding the
+        # same values as _completed().
+        if failures:
+            errors = {(p, c): error for p, c, error in failures}
+            for p, c, context in chunk:
+                if (p, c) in errors:
+                    self._retry(p, c, context, f"Exception in {name} running "
+                                               f"participant {p} in condition {c}:\n"
+                                               f"{errors[(p, c)]}")
+            chunk = [t for t in chunk if (t[0], t[1]) not in errors]
+        if journal:
+            with self._timed("journal"):
+                journal.write((log_name if logfile else None,
+                               log_position,
+                               spans,
+                               [(p, c) for p, c, _ in chunk],
+                               results,
+                               partials))
+        if spans:
+            self._log_spans.extend((self._condition_index[c], p, log_name, *s)
+                                   for p, c, *s in spans)
+        with self._timed("complete"):
+            yield from self._completed(results, partials, duration, keep)
+
+    def _run_inline(self, tasks, journal, logfile, keep):
+        # Called in the control process to run the tasks itself, one chunk at a time,
+        # rather than sending them to workers. It otherwise behaves as a worker would,
+        # writing what the tasks log to a separate file, which is merged with the main
+        # log at the end. A generator yielding the same values as _completed().
+        self._worker_name = "inline"
+        log_name = self._log_prefix + self._worker_name
+        inline_log = (None, None)
+        if logfile:
+            with self._using_log(inline_log):
+                self._open_log(Path(self._log_dir, log_name))
+                inline_log = (self._log_file, self._logwriter)
+            self._log_segments[log_name] = (Path(self._log_dir, log_name), None)
+        try:
+            with self._using_log(inline_log):
+                self.setup()
+            while self._tasks_completed < self._total_tasks:
+                with self._timed("prepare"):
+                    chunk = self._next_chunk(tasks, self._total_tasks - self._tasks_completed)
+                if chunk:
+                    dispatched = time.time()
+                    with self._using_log(inline_log):
+                        start = time.perf_counter()
+                        results, partials, spans, failures, times = self._run_chunk(
+                            chunk, self._condition_contexts)
+                        duration = time.perf_counter() - start
+                        log_position = (self._log_position()
+                                        if self._journaling and logfile else None)
+                    if times:
+                        self._record_chunk(self._worker_name, chunk, (dispatched, 0), 0,
+                                           failures, (times, 0.0))
+                    yield from self._chunk_completed(self._worker_name, log_name, chunk,
+                                                     results, partials, spans, log_position,
+                                                     duration, failures, journal, logfile,
+                                                     keep)
+                yield from self._completed_failures(keep)
+        finally:
+            if inline_log[0]:
+                inline_log[0].close()
+
+    @contextmanager
+    def _using_log(self, log):
+        # Temporarily directs the output of log() to log, a tuple of a file and the writer
+        # wrapping it, as set by _open_log().
+        saved = (self._log_file, self._logwriter)
+        self._log_file, self._logwriter = log
+        try:
+            yield
+        finally:
+            self._log_file, self._logwriter = saved
+
+    def _retry(self, participant, condition, context, description):
+        # Called in the control process when a task has failed, to arrange for it to be
+        # run again, unless it has already been tried as often as allowed, in which case
+        # participant_failed() decides what becomes of it.
+        self._attempts[(participant, condition)] += 1
+        if self._attempts[(participant, condition)] > self._retries:
+            self._failed.append((participant, condition,
+                                 self.participant_failed(participant, condition, description)))
+            return
+        logging.warning(f"{description}\nRetrying it.")
+        self._requeued.append((participant, condition, context))
+
+    def _completed_failures(self, keep):
+        # Called in the control process to complete those tasks that have failed too
+        # often, with the results returned for them by participant_failed(). A generator
+        # yielding the same values as _completed().
+        while self._failed:
+            p, c, result = self._failed.popleft()
+            if self._reduce:
+                partial = self.reduce_accumulate(self.reduce_init(c), p, c, result)
+                yield from self._completed(None, {c: (1, partial)}, None, keep)
+            else:
+                yield from self._completed([(p, c, result)], None, None, keep)
+
+    def _abandon_chunk(self, worker, description):
+        # Called in the control process when a worker has stopped, or is being stopped,
+        # before it finishes the chunk it is running. The tasks in that chunk are charged
+        # with a failure, since one of them presumably caused the problem, unless a copy
+        # of it is still running elsewhere, and those in any further chunks sent to the
+        # worker are simply sent elsewhere.
+        number, chunk = worker.received()
+        if not self._drop_copy(worker, number):
+            for p, c, context in chunk:
+                self._retry(p, c, context, f"{description} while running participant {p} "
+                                           f"in condition {c}")
+        self._requeue(worker)
+
+    def _requeue(self, worker):
+        # Called in the control process to send elsewhere any chunks that have been
+        # sent to worker and not yet started.
+        while worker.in_flight:
+            number, chunk = worker.received()
+            if not self._drop_copy(worker, number):
+                self._requeued.extend(chunk)
+
+    def _worker_died(self, worker):
+        # Called in the control process when a worker has exited unexpectedly. A worker
+        # exiting, or a remote agent disconnecting, when it has nothing to do loses no
+        # tasks, so is not a problem.
+        if self._executor == "remote":
+            description = f"{worker.name} disconnected unexpectedly"
+        else:
+            description = (f"{worker.name} exited unexpectedly with exit code "
+                           f"{worker.process.exitcode}")
+        if worker.in_flight:
+            self._abandon_chunk(worker, description)
+        else:
+            logging.warning(description)
+        self._replace_worker(worker)
+
+    def _replace_worker(self, worker):
+        # Called in the control process to stop worker, if it has not already stopped,
+        # and start a new one in its place, unless it is a remote agent. Chunks sent to
+        # it that have not yet been started are sent elsewhere. It is not waited for
+        # here, but joined along with the others once the experiment has finished.
+        worker.terminate()
+        self._requeue(worker)
+        self._workers.remove(worker)
+        self._dead_workers.append(worker)
+        if self._executor == "remote":
+            return
+        w = _Worker(self, f"worker-{next(self._worker_numbers):04d}")
+        self._log_segments[w.log_name] = (Path(self._log_dir, w.log_name), None)
+        self._workers.append(w)
+        w.start()
+
+    @staticmethod
+    def _join(workers):
+        # Waits for workers to finish, which, for remote agents, includes receiving their
+        # logs.
+        for w in workers:
+            w.process.join()
+
+    def _check_timeouts(self):
+        # Called in the control process to stop and replace any worker that has been
+        # running its current chunk for longer than task_timeout allows.
+        if self._task_timeout is None:
+            return
+        now = time.monotonic()
+        for w in list(self._workers):
+            if w.in_flight and w.ready and now >= self._deadline(w):
+                self._abandon_chunk(w, f"{w.name} timed out")
+                self._replace_worker(w)
+
+    def _deadline(self, worker):
+        # The time by which worker, which must be ready, should have finished the chunk it
+        # is running.
+        return worker.started + self._task_timeout * len(worker.in_flight[0][1])
+
+    def _straggling_since(self, worker):
+        # The time after which the chunk worker is running has taken so much longer than
+        # expected that it is worth running a copy of it, or None if there is no
+        # estimate yet of how long it should take, or a copy is already running.
+        if (self._task_duration is None or not worker.in_flight or not worker.ready
+                or worker.in_flight[0][0] in self._copies):
+            return None
+        expected = self._task_duration * len(worker.in_flight[0][1])
+        return worker.started + STRAGGLER_FACTOR * expected
+
+    def _speculate(self, idle):
+        # Called in the control process when there are no more tasks to send and worker
+        # idle has nothing to do, to send it a copy of the chunk that has been running
+        # the longest beyond what was expected, if any.
+        now = time.monotonic()
+        candidates = [w for w in self._workers
+                      if (t := self._straggling_since(w)) is not None and t <= now]
+        if not candidates:
+            return
+        w = min(candidates, key=lambda w: w.started)
+        number, chunk = w.in_flight[0]
+        self._send(idle, chunk, number)
+        self._copies[number] = {w, idle}
+
+    def _drop_copy(self, worker, number):
+        # Called in the control process when worker will not be returning a result for
+        # chunk number. Returns true if that does not matter, because a copy of it has
+        # already returned one, or another copy is still outstanding.
+        if number not in self._copies:
+            return False
+        others = self._copies[number]
+        others.discard(worker)
+        result = number in self._settled or bool(others)
+        self._drop_copies(number)
+        return result
+
+    def _drop_copies(self, number):
+        # Forgets about the copies of chunk number, once none remain outstanding.
+        if number in self._copies and not self._copies[number]:
+            del self._copies[number]
+            self._settled.discard(number)
+
+    def _next_deadline(self):
+        # Called in the control process to determine how long to wait for the next
+        # message from a worker before something else needs attention: a worker running
+        # for too long, or, if speculative, a chunk becoming worth copying to an idle
+        # worker. Returns None if there is no such limit.
+        deadlines = []
+        if self._task_timeout is not None:
+            deadlines.extend(self._deadline(w) for w in self._workers
+                             if w.in_flight and w.ready)
+        if self._speculative and any(not w.in_flight for w in self._workers):
+            deadlines.extend(t for w in self._workers
+                             if (t := self._straggling_since(w)) is not None)
+        if not deadlines:
+            return None
+        return max(min(deadlines) - time.monotonic(), 0)
+
+    def _cache_path(self, participant, condition):
+        # The file in which the result of the task for participant in condition is cached.
+        cls = type(self)
+        key = hashlib.sha256("\0".join((f"{cls.__module__}.{cls.__qualname__}",
+                                        self._cache_version,
+                                        repr(condition),
+                                        str(participant),
+                                        str(self.task_seed(participant, condition))))
+                             .encode()).hexdigest()
+        return Path(self._cache, key[:2], f"{key}.pickle")
+
+    def _save_cached(self, participant, condition, result):
+        # Called in a worker process to save the result of a task in the cache. The file is
+        # written under a temporary name and then renamed, so a partially written one is
+        # never read.
+        path = self._cache_path(participant, condition)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp = path.with_name(f"{path.name}.{self._worker_name}")
+            with open(temp, "wb") as f:
+                pickle.dump(self._cache_value(participant, condition, result), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+        except Exception:
+            logging.exception(f"Could not cache the result of participant {participant} "
+                              f"in condition {condition}")
+
+    def _cached_results(self, done, keep):
+        # Called in the control process, before any tasks are sent to workers, to complete
+        # those whose results are already cached, adding them to done. A generator
+        # yielding the same values as _completed().
+        for c in self._conditions:
+            if self._condition_completions[c] == self._condition_size(c):
+                continue
+            results = []
+            for p in range(self._participants):
+                if (p, c) in done:
+                    continue
+                try:
+                    with open(self._cache_path(p, c), "rb") as f:
+                        value = pickle.load(f)
+                except FileNotFoundError:
+                    continue
+                except Exception:
+                    logging.exception(f"Ignoring the unreadable cached result of "
+                                      f"participant {p} in condition {c}")
+                    continue
+                done.add((p, c))
+                results.append((p, c, self._from_cache(p, c, value)))
+            if not results:
+                continue
+            if self._reduce:
+                partial = self.reduce_init(c)
+                for p, c, result in results:
+                    partial = self.reduce_accumulate(partial, p, c, result)
+                yield from self._completed(None, {c: (len(results), partial)}, None, keep)
+            else:
+                yield from self._completed(results, None, None, keep)
+
+    def _prepared_tasks(self, done):
+        # Called in the control process, a generator yielding a tuple (participant,
+        # condition, context) for each task, in the order they are to be dispatched, as
+        # determined by the schedule. Since this is lazy, contexts are only prepared as
+        # they are about to be sent to a worker, a condition's when the first of its tasks
+        # is. Tasks whose (participant, condition) is in done have already been completed.
+        # Rather than a participant's whole context, only how it differs from the
+        # condition's is included, as a tuple of a dictionary of the entries added or
+        # replaced and a list of the keys of those removed.
+        pending = {c: (p for p in range(self._participants) if (p, c) not in done)
+                   for c in self._conditions
+                   if c not in self._condition_sizes
+                   and self._condition_completions[c] < self._participants}
+        if self._schedule == "interleave":
+            order = self._interleaved(pending)
+        elif self._schedule == "longest_first":
+            order = self._longest_first(pending)
+        else:
+            order = ((p, c) for c, participants in pending.items() for p in participants)
+        prepared = set()
+        for p, c in order:
+            if c in self._condition_sizes:
+                # stopped adaptively while this task was waiting to be dispatched
+                continue
+            self._outstanding[c] += 1
+            if c not in prepared:
+                condition_context = dict()
+                self.prepare_condition(c, condition_context)
+                self._condition_contexts[c] = condition_context
+                prepared.add(c)
+            condition_context = self._condition_contexts[c]
+            participant_context = dict(condition_context)
+            self.prepare_participant(p, c, participant_context)
+            yield p, c, ({k: v for k, v in participant_context.items()
+                          if k not in condition_context or condition_context[k] is not v},
+                         [k for k in condition_context if k not in participant_context])
+
+    def _interleaved(self, pending):
+        # Yields (participant, condition) taking a participant from each condition in turn.
+        # The values of pending are iterators over the participants yet to be run.
+        turns = deque(pending.items())
+        while turns:
+            c, participants = turns.popleft()
+            for p in participants:
+                yield p, c
+                turns.append((c, participants))
+                break
+
+    def _longest_first(self, pending):
+        # Yields (participant, condition) in decreasing order of expected cost, as returned
+        # by task_cost() or, if it returns None, as learned in _note_duration(). Costs are
+        # learned per condition, so once every condition has been tried the costliest
+        # remaining condition is run until it is exhausted, or until learning more changes
+        # which that is; conditions not yet timed are presumed as costly as the costliest.
+        pending = dict(pending)
+        first = next(((p, c) for c, participants in pending.items() for p in participants),
+                     None)
+        if first is None:
+            return
+        p, c = first
+        if (cost := self.task_cost(p, c)) is not None:
+            costs = [(cost, self._condition_index[c], p, c)]
+            for c, participants in pending.items():
+                for p in participants:
+                    if (cost := self.task_cost(p, c)) is None:
+                        raise RuntimeError(f"task_cost() returned None for participant {p} "
+                                           f"in condition {c}, but not for all tasks")
+                    costs.append((cost, self._condition_index[c], p, c))
+            # sort stably, so that ties are run in the usual order
+            costs.sort(key=lambda t: (-t[0], t[1], t[2]))
+            for _, _, p, c in costs:
+                yield p, c
+            return
+        yield p, c
+        tried = {c}
+        while pending:
+            untried = next((c for c in pending if c not in tried), None)
+            if untried is not None:
+                c = untried
+                tried.add(c)
+            else:
+                default = max(self._condition_costs.values(), default=0)
+                c = max(pending, key=lambda c: self._condition_costs.get(c, default))
+            for p in pending[c]:
+                yield p, c
+                break
+            else:
+                del pending[c]
+
+    def _send(self, worker, chunk, number):
+        # Called in the control process to send a chunk of tasks to worker, preceded by
+        # the contexts of any conditions in it that the worker does not yet have, the
+        # conditions whose contexts it has but which no longer have tasks to run, and, for
+        # a remote agent, which cannot read them itself, the contents of the files of any
+        # objects that have been published since it was last sent a chunk.
+        new = dict()
+        for _, c, _ in chunk:
+            if c not in worker.contexts and c not in new:
+                new[c] = self._condition_contexts[c]
+        stale = [c for c in worker.contexts if c not in self._condition_contexts]
+        worker.contexts.difference_update(stale)
+        worker.contexts.update(new)
+        files = []
+        if worker.remote and len(self._published) > worker.published:
+            for name in list(self._published)[worker.published:]:
+                base = self._publication_path(name)
+                # the .pickle last, as it is what marks the object as published
+                for path in (base.with_suffix(".buffers"), base.with_suffix(".pickle")):
+                    files.append((path.name, path.read_bytes()))
+            worker.published = len(self._published)
+        worker.send(chunk, number, (new, stale, files))
+
+    def _completed(self, results, partials, duration, keep):
+        # Called in the control process with the results of a chunk of tasks returned by
+        # a worker. A generator yielding a tuple (condition, participant, result) for
+        # each completed task, or for each completed condition if reducing.
+        if partials is not None:
+            self._note_duration(duration, {c: n for c, (n, _) in partials.items()})
+            for c, (n, partial) in partials.items():
+                self._reductions[c] = self.reduce_merge(
+                    self._reductions[c] if c in self._reductions else self.reduce_init(c),
+                    partial)
+                self._tasks_completed += n
+                self._condition_completions[c] += n
+                assert self._condition_completions[c] <= self._participants
+                if self._progress:
+                    self._progress.update(n)
+                if self._condition_completions[c] == self._condition_size(c):
+                    self._condition_contexts.pop(c, None)
+                    result = self.reduce_finalize(c, self._reductions.pop(c))
+                    if keep:
+                        self._results[c] = self.finish_condition(c, result)
+                    yield c, None, result
+            return
+        self._note_duration(duration, Counter(c for _, c, _ in results))
+        for p, c, result in results:
+            result = self.finish_participant(p, c, self._received(p, c, result))
+            self._tasks_completed += 1
+            self._condition_completions[c] += 1
+            assert self._condition_completions[c] <= self._participants
+            if self._progress:
+                self._progress.update()
+            if self._precision is not None:
+                self._note_statistic(p, c, result)
+            if self._condition_completions[c] == self._condition_size(c):
+                self._condition_contexts.pop(c, None)
+            if keep:
+                self._retain(p, c, result)
+                if self._condition_completions[c] == self._condition_size(c):
+                    self._results[c] = self.finish_condition(c, self._condition_results(c))
+            yield c, p, result
+
+    def _condition_size(self, condition):
+        # The number of participants that will be run in condition, fewer than
+        # participants only if it has been stopped adaptively.
+        return self._condition_sizes.get(condition, self._participants)
+
+    def _note_statistic(self, participant, condition, result):
+        # Called in the control process, when adapting the number of participants, on
+        # each result as it is completed, to accumulate the mean and variance of its
+        # statistic, with Welford's algorithm, and to stop dispatching further tasks in
+        # its condition once the statistic is estimated precisely enough. Any tasks
+        # already dispatched are still completed, and included.
+        c = condition
+        if self._outstanding[c]:
+            self._outstanding[c] -= 1
+        self._condition_extents[c] = max(self._condition_extents[c], participant + 1)
+        if c in self._condition_sizes:
+            return
+        value = self.participant_statistic(participant, c, result)
+        if value is None:
+            return
+        n, mean, m2 = self._statistics.get(c, (0, 0.0, 0.0))
+        n += 1
+        delta = value - mean
+        mean += delta / n
+        m2 += delta * (value - mean)
+        self._statistics[c] = (n, mean, m2)
+        if n < self._min_participants or self._condition_completions[c] == self._participants:
+            return
+        z = statistics.NormalDist().inv_cdf((1 + self._confidence) / 2)
+        if z * sqrt(m2 / (n - 1) / n) > self._precision:
+            return
+        size = self._condition_completions[c] + self._outstanding[c]
+        self._condition_sizes[c] = size
+        self._total_tasks -= self._participants - size
+        if self._progress:
+            self._progress.total = self._total_tasks
+            self._progress.refresh()
+
+    def _allocate_results(self, keep):
+        # Called in the control process, before any workers are started, to prepare the
+        # data structures into which results will be collected.
+        if not keep:
+            self._results = None
+        elif self._reduce:
+            self._results = dict.fromkeys(self._conditions)
+        else:
+            self._results = {c: [None] * self._participants for c in self._conditions}
+
+    def _received(self, participant, condition, result):
+        # Called in the control process on each result returned by a worker, returning
+        # the value to be passed to finish_participant().
+        return result
+
+    def _retain(self, participant, condition, result):
+        # Called in the control process to retain the value returned by
+        # finish_participant() until it can be passed to finish_condition().
+        self._results[condition][participant] = result
+
+    def _condition_results(self, condition):
+        # Called in the control process to get the value to be passed to
+        # finish_condition(), omitting, if the condition was stopped adaptively, those
+        # participants beyond the last that was run.
+        if condition in self._condition_sizes:
+            return self._results[condition][:self._condition_extents[condition]]
+        return self._results[condition]
+
+    def _release_results(self):
+        # Called in the control process when the experiment has finished, whether
+        # successfully or not, to release any resources held by _allocate_results().
+        pass
+
+    def _cache_value(self, participant, condition, result):
+        # Called in a worker process to get the value to be cached for the result of a
+        # task, as returned by run_participant().
+        return result
+
+    def _from_cache(self, participant, condition, value):
+        # Called in the control process with a value read from the cache, returning the
+        # corresponding result, as if returned by run_participant() in a worker.
+        return value
+
+    def _export(self, obj):
+        # Called in a worker process to prepare obj for sending to the control process.
+        # If result_buffer_threshold is set, large buffers are written to files in the
+        # temporary directory, and only the names of those files and the remainder of
+        # obj, pickled, are sent.
+        if self._result_buffer_threshold is None:
+            return obj
+        names = []
+        def out_of_band(buffer):
+            with buffer.raw() as raw:
+                if raw.nbytes < self._result_buffer_threshold:
+                    return True
+                name = f"{self._worker_name}-{next(self._segments)}.buf"
+                with open(Path(self._tempdir, name), "wb") as f:
+                    f.write(raw)
+            names.append(name)
+            return False
+        return pickle.dumps(obj, protocol=5, buffer_callback=out_of_band), names
+
+    def _import(self, payload):
+        # Called in the control process to reconstruct an object prepared by _export().
+        # The buffers written to files are mapped copy-on-write, and so are shared rather
+        # than copied; the files themselves are removed as soon as they are mapped, their
+        # storage being reclaimed once the values using them are no longer referenced.
+        if self._result_buffer_threshold is None:
+            return payload
+        data, names = payload
+        buffers = []
+        for name in names:
+            path = Path(self._tempdir, name)
+            with open(path, "rb") as f:
+                buffers.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+            try:
+                os.unlink(path)
+            except OSError:
+                # Windows does not allow removing a file that is mapped; it will instead
+                # be removed with the temporary directory
+                pass
+        return pickle.loads(data, buffers=buffers)
+
+    def _discard(self, payload):
+        # Called in the control process to remove any files written by _export() for a
+        # payload that is not going to be imported.
+        if self._result_buffer_threshold is None:
+            return
+        for name in payload[1]:
+            try:
+                os.unlink(Path(self._tempdir, name))
+            except OSError:
+                pass
+
+    def _next_chunk_size(self, remaining):
+        # The number of tasks to send to a worker in the next chunk. When adapting this
+        # we aim for chunks of about TARGET_CHUNK_DURATION seconds, but never so large
+        # that there are fewer than CHUNKS_PER_PROCESS chunks left for each worker.
+        if self._chunk_size != "auto":
+            return self._chunk_size
+        if not self._task_duration:
+            return 1
+        return max(1, min(int(TARGET_CHUNK_DURATION / self._task_duration),
+                          remaining // (self._process_count * CHUNKS_PER_PROCESS)))
+
+    @contextmanager
+    def _timed(self, name):
+        # Records how long the enclosed code takes in the control process, if instrumenting.
+        if not self._instrument:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._controller_records.append((name, start, time.time()))
+
+    def _record_chunk(self, name, chunk, dispatched, size, failures, timings):
+        # Called in the control process, if instrumenting, to record when the tasks in a
+        # chunk were sent to a worker, started, ended and their results received, and the
+        # sizes of the messages carrying them.
+        received = time.time()
+        times, export = timings
+        sent_at, sent = dispatched
+        failed = {(p, c) for p, c, _ in failures}
+        self._chunk_records.append((name, len(chunk), sent_at, received, sent, size, export))
+        for (p, c, _), (start, end) in zip(chunk, times):
+            self._task_records.append((name, p, c, sent_at, start, end, received,
+                                       (p, c) in failed))
+
+    def _note_duration(self, duration, counts):
+        # Maintains an exponentially weighted moving average of the time a single task
+        # takes in a worker, for use by _next_chunk_size(), and, if scheduling longest
+        # first, of that of a task in each condition, given counts, a mapping of the
+        # conditions of the tasks that took duration to the number of them in each.
+        count = sum(counts.values())
+        if not count or duration is None:
+            return
+        d = duration / count
+        if self._task_duration is None:
+            self._task_duration = d
+        else:
+            self._task_duration = 0.8 * self._task_duration + 0.2 * d
+        if self._schedule == "longest_first":
+            # each task in a chunk is charged the chunk's mean, which is only approximate
+            # for a chunk containing tasks from more than one condition
+            for c in counts:
+                if c in self._condition_costs:
+                    self._condition_costs[c] = 0.8 * self._condition_costs[c] + 0.2 * d
+                else:
+                    self._condition_costs[c] = d
+
+    def publish(self, name, obj):
+        """ Makes *obj* available to all the worker processes, by calling :meth:`published`
+        with *name*, which should be a string, without copying it into the context of
+        each task. This is intended for large, read only data, such as lookup tables or
+        sets of stimuli, and is typically called from :meth:`prepare_experiment` or
+        :meth:`prepare_condition`; it can only be called in the control process while the
+        experiment is being run. The *obj* is pickled just once, into a temporary file,
+        and any large buffers it contains that support `out-of-band pickling
+        <https://docs.python.org/3/library/pickle.html#out-of-band-buffers>`_, such as
+        those of NumPy arrays, are memory mapped by the workers, and so shared between
+        them rather than copied; the corresponding values they see are read only. The
+        remainder of *obj* is unpickled once in each worker, the first time it is asked
+        for. Since tasks already sent to a worker might still ask for a published object
+        after the control process has moved on, a given *name* can only be published
+        once; an object specific to one condition, for example, should be published
+        under a name including that condition.
+        """
+        if self._published is None:
+            raise RuntimeError("publish() can only be called while the experiment is being run")
+        if name in self._published:
+            raise RuntimeError(f"{name} has already been published")
+        base = self._publication_path(name)
+        extents = []
+        with open(base.with_suffix(".buffers"), "wb") as f:
+            def out_of_band(buffer):
+                with buffer.raw() as raw:
+                    # aligned, for the benefit of vectorized code reading NumPy arrays
+                    f.write(bytes(-f.tell() % 64))
+                    extents.append((f.tell(), raw.nbytes))
+                    f.write(raw)
+                return False
+            data = pickle.dumps(obj, protocol=5, buffer_callback=out_of_band)
+        temp = base.with_suffix(".temp")
+        with open(temp, "wb") as f:
+            pickle.dump((data, extents), f, protocol=5)
+        # renamed only when complete, as workers test for it to see if name is published
+        os.replace(temp, base.with_suffix(".pickle"))
+        self._published[name] = None
+
+    def published(self, name):
+        """ Returns the object published by :meth:`publish` as *name*. Typically this is
+        called in a worker process, from :meth:`run_participant` or :meth:`setup`, but it
+        may also be called in the control process. If nothing has been published as
+        *name* a :exc:`KeyError` is raised.
+        """
+        if self._published is None:
+            raise KeyError(name)
+        if (result := self._published.get(name)) is not None:
+            return result
+        base = self._publication_path(name)
+        try:
+            with open(base.with_suffix(".pickle"), "rb") as f:
+                data, extents = pickle.load(f)
+        except FileNotFoundError:
+            raise KeyError(name)
+        buffers = []
+        if extents:
+            with open(base.with_suffix(".buffers"), "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            buffers = [view[start:start+size] for start, size in extents]
+        result = self._published[name] = pickle.loads(data, buffers=buffers)
+        return result
+
+    def _publication_path(self, name):
+        # The path, without a suffix, of the files in which an object published as name
+        # is stored.
+        digest = hashlib.sha256(str(name).encode()).hexdigest()[:32]
+        return Path(self._tempdir, f"published-{digest}")
+
     def log(self, thing, *more, multiple=False, **kwargs):
         """Writes information to the Alhazen log file.
         If there is no log file this method does nothing. If the log file is not a CSV log
@@ -441,12 +2064,18 @@ class Experiment:
         effectively calls `writerow
         <https://docs.python.org/3/library/csv.html#csv.csvwriter.writerow>`_ on *thing*;
         if *multiple* is true, it instead calls `writerows
-        <https://docs.python.org/3/library/csv.html#csv.csvwriter.writerows>`_.
+        <https://docs.python.org/3/library/csv.html#csv.csvwriter.writerows>`_. Binary log
+        files, written if *fieldtypes* was supplied, behave similarly to CSV ones.
         """
         if not self._logwriter:
             return
         try:
-            if not self._csv:
+            if self._log_dtype is not None:
+                if multiple:
+                    self._logwriter.writerows(thing)
+                else:
+                    self._logwriter.writerow(thing)
+            elif not self._csv:
                 print(thing, *more, file=self._logwriter, **kwargs)
             elif multiple:
                 self._logwriter.writerows(thing)
@@ -458,7 +2087,18 @@ class Experiment:
                 logging.exception("Exception attempting to write Alhazen log")
 
     def _open_log(self, path):
-        file = open(path, "w", newline=("" if self._csv else None))
+        if self._log_dtype is not None:
+            self._logwriter = self._log_file = _BinaryLog(path, self._log_dtype)
+            return self._logwriter
+        newline = "" if self._csv else None
+        if self._log_compression == "gzip":
+            # the default, maximal compression level is much slower, for little benefit
+            file = gzip.open(path, "wt", compresslevel=6, newline=newline)
+        elif self._log_compression == "lzma":
+            file = lzma.open(path, "wt", newline=newline)
+        else:
+            file = open(path, "w", newline=newline)
+        self._log_file = file
         if self._csv == "dict":
             self._logwriter = csv.DictWriter(file, self._fieldnames,
                                              restval=self._restval,
@@ -470,27 +2110,718 @@ class Experiment:
             self._logwriter = file
         return file
 
-    def _run_one(self):
-        # called in the child processes
+    def _merge_logs(self, logfile, segments):
+        # Called in the control process to append the workers' temporary log files to the
+        # main one. The segments map the name of each to a tuple of its path and the
+        # length of it to use, or None if all of it. They are copied a byte range at a
+        # time, without decoding them, and, for a binary log, following a header
+        # describing the whole.
+        logfile.close()
+        if self._log_dtype is not None:
+            segments = {"controller": (Path(self._tempdir, "controller"), None), **segments}
+        with ExitStack() as stack:
+            files = dict()
+            sizes = dict()
+            for n, (path, limit) in segments.items():
+                files[n] = stack.enter_context(open(path, "rb"))
+                sizes[n] = os.fstat(files[n].fileno()).st_size
+                if limit is not None:
+                    sizes[n] = min(sizes[n], limit)
+            if self._log_dtype is None:
+                # not opened for appending, as neither copy_file_range() nor sendfile()
+                # accepts a destination opened with O_APPEND
+                out = stack.enter_context(open(self._logfile, "r+b"))
+                out.seek(0, os.SEEK_END)
+            else:
+                out = stack.enter_context(open(self._logfile, "wb"))
+                _write_npy_header(out, self._log_dtype,
+                                  sum(sizes.values()) // self._log_dtype.itemsize)
+                out.flush()
+            if self._log_spans is None:
+                for n in files:
+                    _copy_range(files[n], out, 0, sizes[n])
+                return
+            # Each worker's output for its tasks is contiguous, so anything before the
+            # first task it ran was written outside any task, and is copied first.
+            firsts = dict(sizes)
+            for _, _, n, start, _ in self._log_spans:
+                firsts[n] = min(firsts[n], start)
+            for n in files:
+                _copy_range(files[n], out, 0, firsts[n])
+            self._log_spans.sort(key=lambda s: s[:2])
+            current = None
+            for _, _, n, start, end in self._log_spans:
+                if current and current[0] == n and current[2] == start:
+                    current[2] = end
+                    continue
+                if current:
+                    _copy_range(files[current[0]], out, current[1], current[2] - current[1])
+                current = [n, start, end]
+            if current:
+                _copy_range(files[current[0]], out, current[1], current[2] - current[1])
+
+    def _log_position(self):
+        # Called in a worker process to find how much has so far been written to its log.
+        if self._log_dtype is not None:
+            if self._journaling:
+                # make sure everything written so far is actually in the file
+                self._log_file.flush()
+            return self._log_file.position()
+        self._log_file.flush()
+        return self._log_file.buffer.tell()
+
+    def _run_chunk(self, chunk, contexts):
+        # Called in a worker process to run the tasks in a chunk, returning their results,
+        # or partial reductions of them, if the log is to be ordered the extent of each
+        # task's output in this worker's log file, a description of any that failed, and
+        # if instrumenting when each task started and ended.
+        results = None if self._reduce else []
+        partials = dict() if self._reduce else None
+        spans = [] if self._ordered_log and self._log_file else None
+        failures = []
+        times = [] if self._instrument else None
+        for p, c, (added, removed) in chunk:
+            context = dict(contexts[c])
+            context.update(added)
+            for k in removed:
+                del context[k]
+            if spans is not None:
+                start = self._log_position()
+            if times is not None:
+                times.append([time.time(), None])
+            if self._cache:
+                seed = self.task_seed(p, c)
+                random.seed(seed)
+                if np is not None:
+                    np.random.seed(seed % 2**32)
+            try:
+                result = self.run_participant(p, c, context)
+            except Exception:
+                logging.exception(f"Exception in Alhazen worker process running "
+                                  f"participant {p} in condition {c}")
+                failures.append((p, c, traceback.format_exc()))
+                continue
+            finally:
+                if times is not None:
+                    times[-1][1] = time.time()
+            if self._cache:
+                self._save_cached(p, c, result)
+            if self._reduce:
+                n, partial = partials.get(c) or (0, self.reduce_init(c))
+                partials[c] = (n + 1, self.reduce_accumulate(partial, p, c, result))
+            else:
+                results.append((p, c, result))
+            if spans is not None:
+                spans.append((p, c, start, self._log_position()))
+        return results, partials, spans, failures, times
+
+    def _run_process(self, name, task_connection, result_connection):
+        # called in the child processes; one forked while the control process is being
+        # profiled inherits its profiler, still active, which must be stopped, both so as
+        # not to profile the worker needlessly and so that the worker's own profiler can
+        # be started, as only one can be active at a time in Python 3.12 and later
+        if self._controller_profiler:
+            self._controller_profiler.disable()
+            self._controller_profiler = None
+        self._run_one(name, task_connection, result_connection)
+
+    def _run_one(self, name, task_connection, result_connection):
+        # called in the child processes, or threads
         logfile = None
+        send = result_connection.send
+        self._worker_name = name
         try:
             if self._logfile:
-                logfile = self._open_log(Path(self._tempdir, current_process().name))
+                logfile = self._open_log(Path(self._log_dir, self._log_prefix + name))
+            self._segments = count()
+            # Chunks are read from the control process in a separate thread so that the
+            # control process can always send a further chunk without blocking, even while
+            # this process is busy running tasks or sending their results.
+            chunks = queue.SimpleQueue()
+            Thread(target=self._receive, args=(task_connection, chunks), daemon=True).start()
+            if self._profile:
+                profiler = cProfile.Profile()
+                profiler.enable()
             self.setup()
-            while True:
-                participant, condition, context = self._task_q.get()
-                if participant is None:
-                    break
-                result = self.run_participant(participant, condition, context)
-                self._result_q.put((participant, condition, result, None))
+            # tell the control process this worker is now ready to start on its first
+            # chunk, so that how long setup() took is not charged to that chunk
+            send(None)
+            contexts = dict()
+            while (message := chunks.get()) is not None:
+                (new, stale, files), chunk = message
+                contexts.update(new)
+                for c in stale:
+                    del contexts[c]
+                for file_name, data in files:
+                    Path(self._tempdir, file_name).write_bytes(data)
+                start = time.perf_counter()
+                results, partials, spans, failures, times = self._run_chunk(chunk, contexts)
+                duration = time.perf_counter() - start
+                payload = self._export((results, partials))
+                send((payload,
+                      spans,
+                      self._log_position() if self._journaling and logfile else None,
+                      duration,
+                      failures,
+                      times and (times, time.perf_counter() - start - duration),
+                      None))
+            if self._profile:
+                profiler.disable()
+                profiler.dump_stats(Path(self._tempdir, f"{name}.prof"))
         except:
             logging.exception("Exception in Alhazen worker process")
-            self._result_q.put((None, None, None, current_process().name))
+            send((None, None, None, None, None, None, name))
             sys.exit(1)
         finally:
             if logfile:
                 logfile.close()
 
+    @staticmethod
+    def _receive(connection, chunks):
+        # Runs in a thread of a worker process, copying chunks from the control process
+        # into a local queue until told to stop, or the control process goes away.
+        while True:
+            try:
+                chunk = connection.recv()
+            except EOFError:
+                chunk = None
+            chunks.put(chunk)
+            if chunk is None:
+                break
+
+
+class _Wait:
+    # Yielded by Experiment._execute() when it needs to wait until at least one of
+    # objects, as accepted by multiprocessing.connection.wait(), is ready, or timeout
+    # seconds have passed, if timeout is not None. The list of those that are ready is
+    # sent back to it.
+
+    def __init__(self, objects, timeout):
+        self.objects = objects
+        self.timeout = timeout
+
+
+class _Call:
+    # Yielded by Experiment._execute() when it needs function called with args, which
+    # may block for some time, but does not involve the workers. The value returned is
+    # sent back to it.
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+
+async def _wait_async(loop, objects, timeout):
+    # Waits, in the event loop, until at least one of objects is ready to be read, or
+    # timeout seconds have passed, returning a list of those that are ready.
+    woken = loop.create_future()
+    def wake():
+        if not woken.done():
+            woken.set_result(None)
+    descriptors = []
+    try:
+        for obj in objects:
+            fd = obj if isinstance(obj, int) else obj.fileno()
+            loop.add_reader(fd, wake)
+            descriptors.append(fd)
+    except NotImplementedError:
+        # for example, Windows' proactor event loop
+        return await loop.run_in_executor(None, wait, objects, timeout)
+    else:
+        try:
+            await asyncio.wait_for(woken, timeout)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        for fd in descriptors:
+            loop.remove_reader(fd)
+    return wait(objects, 0)
+
+
+def _summarize(values):
+    # A dictionary of summary statistics of an iterable of numbers.
+    values = list(values)
+    if not values:
+        return {"count": 0, "total": 0, "mean": None, "median": None, "max": None}
+    return {"count": len(values),
+            "total": sum(values),
+            "mean": statistics.fmean(values),
+            "median": statistics.median(values),
+            "max": max(values)}
+
+
+class _Worker:
+    # The control process's view of one worker process: the process itself, the
+    # connections for sending it chunks of tasks and receiving their results, the
+    # chunks sent to it for which results have not yet been received, each numbered,
+    # whether it is ready, having finished setup(), when it is presumed to have started
+    # the oldest of those chunks, which it cannot do before it is ready, and when each
+    # chunk was sent to it and how large it was, the conditions whose contexts it holds,
+    # and, for a remote agent, how many published objects it has been sent. A remote
+    # agent is connected by a single connection, used both for sending tasks and
+    # receiving results. A worker thread is instead connected by in-memory queues,
+    # through which tasks and results are passed by reference, without pickling.
+
+    def __init__(self, experiment, name, connection=None):
+        self.name = name
+        self.log_name = experiment._log_prefix + name
+        self.remote = connection is not None
+        self.by_reference = experiment._executor == "thread"
+        self.published = 0
+        if self.remote:
+            self.tasks = self.results = connection
+            self._child_connections = ()
+            self.process = _RemoteAgent(experiment, name, connection,
+                                        Path(experiment._log_dir, self.log_name))
+        else:
+            pipe = _thread_pipe if self.by_reference else Pipe
+            tasks_recv, self.tasks = pipe(duplex=False)
+            self.results, results_send = pipe(duplex=False)
+            if self.by_reference:
+                # The thread closes its own ends of the connections when it finishes.
+                self._child_connections = ()
+                self.process = _WorkerThread(experiment, (name, tasks_recv, results_send),
+                                             name)
+            else:
+                self._child_connections = (tasks_recv, results_send)
+                self.process = Process(target=experiment._run_process,
+                                       args=(name, tasks_recv, results_send),
+                                       name=name)
+        # what to wait for to learn that results have arrived
+        self.readable = self.results.connection if self.by_reference else self.results
+        self.in_flight = deque()
+        self.ready = False
+        self.started = None
+        self.dispatched = dict()
+        self.contexts = set()
+
+    def start(self):
+        self.process.start()
+        for c in self._child_connections:
+            c.close()
+
+    def send(self, chunk, number=None, contexts=None):
+        # Pickled explicitly, as Connection.send() would, so as to know its size, unless
+        # passed by reference, in which case its size is recorded as zero. The chunk is
+        # recorded as in flight first, so that it is not lost if sending it fails because
+        # the worker has exited or a remote agent has disconnected.
+        message = chunk and (contexts, chunk)
+        data = None if self.by_reference else ForkingPickler.dumps(message)
+        if chunk is not None:
+            if not self.in_flight and self.ready:
+                self.started = time.monotonic()
+            self.in_flight.append((number, chunk))
+            self.dispatched[number] = (time.time(), 0 if data is None else len(data))
+        if data is None:
+            self.tasks.send(message)
+        else:
+            self.tasks.send_bytes(data)
+
+    def receive(self):
+        # Returns the next message from the worker, and its size in bytes.
+        if self.by_reference:
+            return self.results.recv(), 0
+        data = self.results.recv_bytes()
+        return ForkingPickler.loads(data), len(data)
+
+    def set_ready(self):
+        # Notes that the worker has finished setup(), and so has started on its first
+        # chunk, if it has been sent one.
+        self.ready = True
+        self.started = time.monotonic()
+
+    def received(self):
+        # Removes and returns the oldest chunk in flight, as a tuple (number, chunk). The
+        # worker is presumed to begin on the next one, if any, as soon as it finishes this.
+        result = self.in_flight.popleft()
+        self.started = time.monotonic()
+        return result
+
+    def terminate(self):
+        try:
+            self.process.terminate()
+        except:
+            pass
+
+    def close(self):
+        for c in (self.tasks, self.results) + self._child_connections:
+            c.close()
+        if isinstance(self.process, _WorkerThread):
+            self.process.close()
+
+
+class _ThreadConnection:
+    # One end of a channel made by _thread_pipe().
+
+    def __init__(self, queue, connection):
+        self._queue = queue
+        self.connection = connection
+
+    def send(self, obj):
+        self._queue.put(obj)
+        self.connection.send_bytes(b"")
+
+    def recv(self):
+        self.connection.recv_bytes()
+        return self._queue.get()
+
+    def poll(self, timeout=0.0):
+        return self.connection.poll(timeout)
+
+    def close(self):
+        self.connection.close()
+
+
+def _thread_pipe(duplex=False):
+    # Like Pipe(duplex=False), but for communicating with a worker thread: objects are
+    # passed by reference through an in-memory queue, and the pipe carries only an empty
+    # message for each, so that the receiving end can still be waited for with wait(),
+    # and sees EOFError once the messages have all been received and the sending end
+    # has been closed.
+    assert not duplex
+    objects = queue.SimpleQueue()
+    receiver, sender = Pipe(duplex=False)
+    return _ThreadConnection(objects, receiver), _ThreadConnection(objects, sender)
+
+
+class _WorkerThread(Thread):
+    # A worker run as a thread of the control process rather than as a separate process,
+    # with the parts of the interface of a Process used by _Worker. Each has its own
+    # shallow copy of the experiment, made as it starts, so that what it does in setup()
+    # and run_participant() does not affect the others, and its sentinel becomes ready
+    # when it finishes, as does a process's.
+
+    def __init__(self, experiment, args, name):
+        super().__init__(name=name, daemon=True)
+        self._experiment = experiment
+        self._args = args
+        self.sentinel, self._finished = Pipe(duplex=False)
+        self.exitcode = None
+
+    def run(self):
+        self.exitcode = 1
+        try:
+            # Copied without __getstate__(), which is for the benefit of worker processes
+            # and drops things, such as a shared result array, that threads can share.
+            experiment = object.__new__(type(self._experiment))
+            experiment.__dict__.update(self._experiment.__dict__)
+            experiment._run_one(*self._args)
+            self.exitcode = 0
+        except SystemExit as e:
+            self.exitcode = e.code
+        finally:
+            self._args[2].close()
+            self._finished.close()
+
+    def terminate(self):
+        # A thread cannot be killed; it is left to finish when the connection from which
+        # it reads tasks is closed.
+        pass
+
+    def close(self):
+        self.sentinel.close()
+
+
+class _RemoteAgent:
+    # Stands in for the Process of a worker that is a remote agent, with the parts of
+    # its interface used by _Worker. Starting it sends the agent its name and the
+    # experiment, and joining it receives the contents of the agent's log file, which it
+    # sends once it has been told there are no more tasks, and writes them to log_path.
+    # There is no sentinel, as a remote agent that exits is noticed by its connection
+    # being closed.
+
+    sentinel = None
+    exitcode = None
+
+    def __init__(self, experiment, name, connection, log_path):
+        self._experiment = experiment
+        self._name = name
+        self._connection = connection
+        self._log_path = log_path
+        # so that there is something to merge even if the agent disconnects prematurely
+        log_path.touch()
+
+    def start(self):
+        self._connection.send_bytes(ForkingPickler.dumps((self._name, self._experiment)))
+
+    def join(self):
+        try:
+            with open(self._log_path, "wb") as f:
+                while data := self._connection.recv_bytes():
+                    f.write(data)
+        except (EOFError, OSError):
+            pass
+
+    def terminate(self):
+        self._connection.close()
+
+
+class _Agents:
+    # Accepts, in a thread of the control process, connections from remote agents,
+    # queuing them, and signaling that it has done so by sending something through a
+    # pipe, the arrived end of which can be waited upon along with the workers.
+
+    def __init__(self, address, authkey):
+        self._listener = Listener(address, authkey=authkey)
+        self._connections = queue.SimpleQueue()
+        self.arrived, self._signal = Pipe(duplex=False)
+        self._closing = False
+        Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except Exception as e:
+                if self._closing:
+                    break
+                logging.warning(f"Failed to accept a connection from a remote agent: {e}")
+                continue
+            self._connections.put(connection)
+            self._signal.send(None)
+
+    def accepted(self):
+        # Returns a list of the connections accepted since this was last called.
+        while self.arrived.poll():
+            self.arrived.recv()
+        result = []
+        while not self._connections.empty():
+            result.append(self._connections.get())
+        return result
+
+    def close(self):
+        self._closing = True
+        self._listener.close()
+        for connection in self.accepted():
+            connection.close()
+        self.arrived.close()
+
+
+def _parse_address(address):
+    # Converts a string of the form "host:port" to a tuple suitable for a Listener or
+    # Client, or returns address unchanged if it is not a string.
+    if not isinstance(address, str):
+        return tuple(address)
+    host, _, port = address.rpartition(":")
+    if not (host and port.isdigit()):
+        raise ValueError(f"address must be of the form host:port, not {address}")
+    return host, int(port)
+
+
+def _agent(address, authkey, wait):
+    # Runs in a worker process on a remote machine, connecting to the control process
+    # of an experiment using the "remote" executor and running its tasks until told to
+    # stop, when it sends back anything it logged.
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    with connection, TemporaryDirectory(prefix="alhazen-agent-") as tempdir:
+        name, experiment = ForkingPickler.loads(connection.recv_bytes())
+        experiment._tempdir = experiment._log_dir = tempdir
+        experiment._log_prefix = ""
+        try:
+            experiment._run_one(name, connection, connection)
+        except SystemExit:
+            return
+        log_path = Path(tempdir, name)
+        if log_path.exists():
+            with open(log_path, "rb") as f:
+                while data := f.read(COPY_BLOCK_SIZE):
+                    connection.send_bytes(data)
+        connection.send_bytes(b"")
+
+
+def _main(argv=None):
+    # The command line interface, "python -m alhazen worker host:port", which starts
+    # remote agents.
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m alhazen")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="run worker processes for an experiment "
+                                                "using the remote executor")
+    worker.add_argument("address", help="the host:port on which the experiment is listening")
+    worker.add_argument("--authkey", default=os.environ.get("ALHAZEN_AUTHKEY"),
+                        help="the key authenticating the connection, by default the "
+                             "value of the ALHAZEN_AUTHKEY environment variable")
+    worker.add_argument("--processes", type=int, default=cpu_count(),
+                        help="how many worker processes to run, by default as many as "
+                             "there are cores")
+    worker.add_argument("--wait", type=float, default=60,
+                        help="how many seconds to keep trying to connect")
+    args = parser.parse_args(argv)
+    if not args.authkey:
+        parser.error("an authkey must be supplied")
+    address = _parse_address(args.address)
+    authkey = args.authkey.encode()
+    processes = [Process(target=_agent, args=(address, authkey, args.wait))
+                 for _ in range(max(args.processes, 1))]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    sys.exit(1 if any(p.exitcode for p in processes) else 0)
+
+
+class _Journal:
+    # A durable record, kept in a directory, of the chunks of tasks completed by an
+    # experiment, their results, and where the output written while running them ends in
+    # the workers' log files, which are kept in the same directory. Each record is
+    # pickled and appended to a single file as it is written.
+
+    def __init__(self, directory, resume):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.run = os.urandom(6).hex()
+        self._path = self.directory / "completed"
+        self._resume = resume
+        self._file = None
+        self._last_sync = time.monotonic()
+        if not resume and self._path.exists():
+            for record in self._read():
+                if record[0]:
+                    Path(self.directory, record[0]).unlink(missing_ok=True)
+            self._path.unlink()
+
+    def _read(self):
+        # Yields the complete records in the file, and then truncates it after the last
+        # of them, in case the run that wrote it was interrupted while writing another.
+        length = 0
+        if self._path.exists():
+            with open(self._path, "rb") as f:
+                while True:
+                    try:
+                        record = pickle.load(f)
+                    except Exception:
+                        break
+                    length = f.tell()
+                    yield record
+            os.truncate(self._path, length)
+
+    def replay(self):
+        return self._read() if self._resume else ()
+
+    def write(self, record):
+        if not self._file:
+            self._file = open(self._path, "ab")
+        pickle.dump(record, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.flush()
+        if time.monotonic() - self._last_sync > JOURNAL_SYNC_INTERVAL:
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+class _BinaryLog:
+    # A log file written as the raw records of a NumPy structured array, without any
+    # header. Rows are accumulated in one list per field, and converted to NumPy arrays
+    # and written to the file a block at a time.
+
+    def __init__(self, path, dtype):
+        self._file = open(path, "wb")
+        self._dtype = dtype
+        self._columns = [[] for _ in dtype.names]
+        self._rows = 0
+        self._written = 0
+
+    def writerow(self, row):
+        if isinstance(row, dict):
+            row = [row[name] for name in self._dtype.names]
+        elif len(row) != len(self._columns):
+            raise ValueError(f"Expected a row of {len(self._columns)} values, not {row}")
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        self._rows += 1
+        if self._rows >= LOG_BLOCK_ROWS:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if not self._rows:
+            return
+        block = np.empty(self._rows, self._dtype)
+        for name, column in zip(self._dtype.names, self._columns):
+            block[name] = column
+            column.clear()
+        self._written += self._rows
+        self._rows = 0
+        self._file.write(block.tobytes())
+        self._file.flush()
+
+    def position(self):
+        return (self._written + self._rows) * self._dtype.itemsize
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+def _write_npy_header(file, dtype, rows):
+    header = {"descr": np.lib.format.dtype_to_descr(dtype),
+              "fortran_order": False,
+              "shape": (rows,)}
+    try:
+        np.lib.format.write_array_header_1_0(file, header)
+    except ValueError:
+        # the header is too long for version 1.0 of the format
+        np.lib.format.write_array_header_2_0(file, header)
+
+
+def _copy_range(source, destination, offset, length):
+    # Copies length bytes, starting at offset, from the binary file source to the current
+    # position in the binary file destination, within the kernel if possible.
+    source_fd, destination_fd = source.fileno(), destination.fileno()
+    end = offset + length
+    destination.flush()
+    try:
+        while offset < end and (n := os.copy_file_range(source_fd, destination_fd,
+                                                         end - offset, offset)):
+            offset += n
+    except (AttributeError, OSError):
+        pass
+    try:
+        while offset < end and (n := os.sendfile(destination_fd, source_fd,
+                                                 offset, end - offset)):
+            offset += n
+    except (AttributeError, OSError):
+        pass
+    source.seek(offset)
+    while offset < end and (data := source.read(min(COPY_BLOCK_SIZE, end - offset))):
+        destination.write(data)
+        offset += len(data)
+    destination.flush()
+
+
+def log_to_csv(path, destination, dialect="excel"):
+    """Converts a binary log file, written by an :class:`Experiment` created with
+    *fieldtypes* supplied, to a CSV file. The *path* is the name of the binary log file,
+    and *destination* the name of the CSV file to be written, the first line of which
+    will contain the names of the fields. The rows are written in blocks, using a memory
+    mapped view of the binary log file, so even very large logs can be converted without
+    reading them entirely into memory. The *dialect* is passed to the :class:`csv.writer`
+    used to write the CSV file.
+    """
+    if np is None:
+        raise RuntimeError("NumPy must be installed to use log_to_csv()")
+    log = np.load(path, mmap_mode="r")
+    with open(destination, "w", newline="") as f:
+        writer = csv.writer(f, dialect=dialect)
+        writer.writerow(log.dtype.names)
+        for i in range(0, len(log), LOG_BLOCK_ROWS):
+            writer.writerows(log[i:i + LOG_BLOCK_ROWS].tolist())
+
 
 class IteratedExperiment(Experiment):
     """This is a an abstract base class, a subclass of :class:`Experiment`, for
@@ -513,13 +2844,91 @@ class IteratedExperiment(Experiment):
     which which is accumlated into a list, indexed by round. This list is returned to the
     parent, control process as the result for the participant and condition.
 
+    For experiments with many participants and many rounds, building these lists, and
+    transferring them from the worker processes to the control process, can be
+    expensive. If the values returned by :meth:`run_participant_run` are all numbers, or
+    other values representable in a fixed size `NumPy <https://numpy.org/>`_ data type,
+    *result_dtype* can be supplied, a NumPy ``dtype`` or a value convertible to one. In
+    this case NumPy must be installed. A NumPy array of shape (*conditions*,
+    *participants*, *rounds*) of this type is allocated in shared memory before the
+    experiment is run, and the worker processes write the value for each round directly
+    into it. Instead of lists, :meth:`run_participant_finish` and :meth:`finish_participant`
+    are passed the one dimensional slice of this array for their participant and
+    condition, containing just the rounds actually executed, and the values they return
+    are ignored, though they may modify this slice in place. :meth:`finish_condition` is
+    passed the two dimensional slice for its condition, indexed by participant and round,
+    and so, by default, :meth:`run` returns these two dimensional arrays in place of lists
+    of lists. Elements for rounds that were not executed, because
+    :meth:`run_participant_continue` returned false, are zero; the number of rounds
+    actually executed is available in :attr:`round_counts`. If *result_file* is also
+    supplied, the array is instead a memory mapped file of that name, in NumPy's ``.npy``
+    format, which remains after the experiment has finished, and can later be read with
+    ``numpy.load``. Typed results cannot be combined with *reduce*, nor with
+    *speculative*, as both copies of a task would write to the same elements of the
+    array. The *result_file* must be supplied if typed results are to be recorded in a
+    journal, since the journal then records only the number of rounds completed by each
+    participant; when resuming, the values already written to *result_file* are retained.
+    If :meth:`participant_failed` is overridden when *result_dtype* is supplied it should
+    return the number of rounds to be treated as executed, typically zero.
+
+    Calling :meth:`run_participant_run` once per round for each participant can itself
+    be a substantial cost when the work of a round is small, but many models can
+    instead be written to operate on arrays of participants at once. If *lockstep* is
+    true, which requires that NumPy be installed, the participants in each chunk sent to
+    a worker, as determined by *chunk_size*, that are in the same condition are run
+    together, as a block, advancing through the rounds in step, with one call per round
+    of :meth:`run_round_batch` for the whole block, in place of
+    :meth:`run_participant_run`, and similarly :meth:`run_batch_prepare`,
+    :meth:`run_batch_continue` and :meth:`run_batch_finish` in place of the other
+    methods called for each participant. The *chunk_size* should therefore be large; if
+    it is not supplied it defaults, when *lockstep* is true, to ``"auto"``, which
+    chooses a size as usual. The results are the same as if each
+    participant had been run individually, and can be typed, as above. Since the
+    participants in a block share the log output written while running it, *lockstep*
+    cannot be combined with *ordered_log*, nor, as their random numbers are not drawn
+    independently, with *cache*. If running a block fails, all its participants are
+    treated as having failed; any *retries* are run individually, in blocks of one.
+
     As a subclass of :class:`Experiment` the other methods and attributes of that parent
     class are, of course, also available.
     """
 
-    def __init__(self, rounds=1, **kwargs):
+    def __init__(self, rounds=1, result_dtype=None, result_file=None, lockstep=False,
+                 **kwargs):
+        if lockstep:
+            # blocks of one participant would gain nothing from running in lockstep
+            kwargs.setdefault("chunk_size", "auto")
         super().__init__(**kwargs)
         self._rounds = rounds
+        if lockstep:
+            if np is None:
+                raise RuntimeError("NumPy must be installed to use lockstep")
+            if self._ordered_log or self._cache:
+                raise RuntimeError("lockstep cannot be used with ordered_log or cache")
+        self._lockstep = lockstep
+        if result_dtype is not None:
+            if np is None:
+                raise RuntimeError("NumPy must be installed to use result_dtype")
+            if self._reduce:
+                raise RuntimeError("result_dtype cannot be used with reduce")
+            if self._speculative or self._executor == "remote":
+                raise RuntimeError('result_dtype cannot be used with speculative or the '
+                                   '"remote" executor')
+            result_dtype = np.dtype(result_dtype)
+        self._result_dtype = result_dtype
+        self._result_file = result_file
+        self._result_array = None
+        self._result_shm = None
+        self._result_name = None
+        self._round_counts = None
+
+    def __getstate__(self):
+        # The shared result array must not be copied when this object is sent to a worker
+        # process that is spawned rather than forked; the worker instead attaches to it.
+        state = super().__getstate__()
+        state["_result_array"] = None
+        state["_result_shm"] = None
+        return state
 
     @property
     def rounds(self):
@@ -529,6 +2938,42 @@ class IteratedExperiment(Experiment):
         """
         return self._rounds
 
+    @property
+    def result_dtype(self):
+        """The NumPy ``dtype`` of the values returned by :meth:`run_participant_run`, or
+        ``None`` if the results are collected in lists. This is a read only attribute and
+        cannot be modified after the :class:`IteratedExperiment` is created.
+        """
+        return self._result_dtype
+
+    @property
+    def result_array(self):
+        """If *result_dtype* was supplied, the NumPy array of shape (*conditions*,
+        *participants*, *rounds*) into which the results of the rounds are written, the
+        first index corresponding to the position of the condition in :attr:`conditions`.
+        This is ``None`` until the :class:`IteratedExperiment` has been run, and always
+        ``None`` if *result_dtype* was not supplied.
+        """
+        return self._result_array
+
+    @property
+    def round_counts(self):
+        """If *result_dtype* was supplied, a NumPy array of shape (*conditions*,
+        *participants*) containing the number of rounds actually executed for each
+        participant in each condition. This is ``None`` until the
+        :class:`IteratedExperiment` has been run, and always ``None`` if *result_dtype*
+        was not supplied.
+        """
+        return self._round_counts
+
+    @property
+    def lockstep(self):
+        """Whether the participants in each chunk are run together, in blocks, using
+        :meth:`run_round_batch`. This is a read only attribute and cannot be modified
+        after the :class:`IteratedExperiment` is created.
+        """
+        return self._lockstep
+
     def run_participant_prepare(self, participant, condition, context):
         """This method is called at the start of a worker process running a participant's
         activity, before the loop in which :meth:`run_participant_run` is called. Its
@@ -594,6 +3039,8 @@ class IteratedExperiment(Experiment):
         return results
 
     def run_participant(self, participant, condition, context):
+        if self._result_dtype is not None:
+            return self._run_participant_typed(participant, condition, context)
         results = []
         self.run_participant_prepare(participant, condition, context)
         for round in range(self.rounds):
@@ -601,3 +3048,247 @@ class IteratedExperiment(Experiment):
                 break
             results.append(self.run_participant_run(round, participant, condition, context))
         return self.run_participant_finish(participant, condition, results)
+
+    def _run_participant_typed(self, participant, condition, context):
+        # Writes the results of the rounds directly into the shared result array, and
+        # returns only the number of rounds executed to the control process.
+        if self._result_array is None:
+            self._attach_result_array()
+        row = self._result_array[self._condition_index[condition], participant]
+        # discard anything left by an earlier, failed or interrupted attempt
+        row[...] = 0
+        n = 0
+        self.run_participant_prepare(participant, condition, context)
+        for round in range(self.rounds):
+            if not self.run_participant_continue(round, participant, condition, context):
+                break
+            row[round] = self.run_participant_run(round, participant, condition, context)
+            n = round + 1
+        self.run_participant_finish(participant, condition, row[:n])
+        return n
+
+    def run_batch_prepare(self, participants, condition, contexts):
+        """When the :class:`IteratedExperiment` was created with *lockstep* true, this
+        method is called in a worker process at the start of running a block of
+        participants together, in place of :meth:`run_participant_prepare`. The
+        *participants* are a NumPy array of the participants in the block, in increasing
+        order, all in *condition*, and *contexts* is a list of their contexts, in the same
+        order. The value returned is the *state* passed to the other methods called for
+        this block, and will typically contain NumPy arrays with one element, or row, per
+        participant. This method is intended to be overridden in subclasses, and should
+        not be called directly by the programmer. The default implementation of this
+        method returns *contexts*.
+        """
+        return contexts
+
+    def run_batch_continue(self, round, participants, condition, state):
+        """When the :class:`IteratedExperiment` was created with *lockstep* true, this
+        method is called in a worker process before each call of :meth:`run_round_batch`,
+        in place of :meth:`run_participant_continue`, with the same *participants* that
+        would be passed to it, those of the block still running. It should return a
+        boolean NumPy array, or other sequence, of the same length as *participants*, true
+        for each participant that should run this round, and false for each whose
+        activities should end, or a single boolean applying to them all. Once a
+        participant has ended it is not passed to these methods again. This method is
+        intended to be overridden in subclasses, and should not be called directly by the
+        programmer. The default implementation of this method returns ``True``.
+        """
+        return True
+
+    def run_round_batch(self, round, participants, condition, state):
+        """When the :class:`IteratedExperiment` was created with *lockstep* true, this
+        method should be overridden to perform one round's worth of activity by all the
+        *participants* in a block that are still running, in a worker process, in place
+        of :meth:`run_participant_run`. The *participants* are a NumPy array of those
+        still running, in increasing order, a subset of those passed to
+        :meth:`run_batch_prepare`, so their positions in the whole block, for indexing
+        arrays in *state*, are given by ``numpy.searchsorted(block, participants)``, where
+        *block* is the latter. The *state* is the value
+        returned by :meth:`run_batch_prepare`, and may be modified. This method should
+        return a NumPy array, or other sequence, of the same length as *participants*,
+        containing the value for this round of each, just as :meth:`run_participant_run`
+        would have returned it. This method must be overridden by subclasses that are
+        run with *lockstep*, and should not be called directly by the programmer. The
+        default implementation of this method raises a :exc:`NotImplementedError`.
+        """
+        raise NotImplementedError("The run_round_batch() method must be overridden")
+
+    def run_batch_finish(self, participants, condition, results, state):
+        """When the :class:`IteratedExperiment` was created with *lockstep* true, this
+        method is called in a worker process after all the rounds for a block of
+        participants have been executed, in place of :meth:`run_participant_finish`. The
+        *participants* and *state* are as for :meth:`run_batch_prepare`, and *results* is
+        a list, in the same order as *participants*, of what would have been passed to
+        :meth:`run_participant_finish` for each. This method should return a list of the
+        values to be returned to the control process for each participant, also in the
+        same order; if *result_dtype* was supplied the value returned is ignored. This
+        method is intended to be overridden in subclasses, and should not be called
+        directly by the programmer. The default implementation of this method returns
+        *results* unchanged.
+        """
+        return results
+
+    def _run_chunk(self, chunk, contexts):
+        # When in lockstep, runs the tasks in a chunk as one block for each condition,
+        # returning the same values as Experiment._run_chunk(). Each task in a block is
+        # recorded as starting and ending when the block does.
+        if not self._lockstep:
+            return super()._run_chunk(chunk, contexts)
+        results = None if self._reduce else []
+        partials = dict() if self._reduce else None
+        failures = []
+        times = [None] * len(chunk) if self._instrument else None
+        blocks = defaultdict(list)
+        for i, (p, c, (added, removed)) in enumerate(chunk):
+            context = dict(contexts[c])
+            context.update(added)
+            for k in removed:
+                del context[k]
+            blocks[c].append((p, i, context))
+        for c, block in blocks.items():
+            block.sort(key=lambda t: t[0])
+            start = time.time()
+            try:
+                block_results = self._run_block(np.array([p for p, _, _ in block]), c,
+                                                [context for _, _, context in block])
+            except Exception:
+                logging.exception(f"Exception in Alhazen worker process running "
+                                  f"participants {[p for p, _, _ in block]} in condition {c}")
+                description = traceback.format_exc()
+                failures.extend((p, c, description) for p, _, _ in block)
+                continue
+            finally:
+                if times is not None:
+                    end = time.time()
+                    for _, i, _ in block:
+                        times[i] = [start, end]
+            for (p, _, _), result in zip(block, block_results):
+                if self._reduce:
+                    n, partial = partials.get(c) or (0, self.reduce_init(c))
+                    partials[c] = (n + 1, self.reduce_accumulate(partial, p, c, result))
+                else:
+                    results.append((p, c, result))
+        return results, partials, None, failures, times
+
+    def _run_block(self, participants, condition, contexts):
+        # Runs a block of participants, a NumPy array, in lockstep, returning a list of
+        # their results, or, if typed, of the numbers of rounds each executed.
+        typed = self._result_dtype is not None
+        if typed:
+            if self._result_array is None:
+                self._attach_result_array()
+            rows = self._result_array[self._condition_index[condition]]
+            # discard anything left by an earlier, failed or interrupted attempt
+            rows[participants] = 0
+        else:
+            results = [[] for _ in participants]
+        counts = np.zeros(len(participants), dtype=int)
+        # the positions in the block of the participants still running
+        running = np.arange(len(participants))
+        state = self.run_batch_prepare(participants, condition, contexts)
+        for round in range(self.rounds):
+            mask = self.run_batch_continue(round, participants[running], condition, state)
+            running = running[np.broadcast_to(np.asarray(mask, dtype=bool), running.shape)]
+            if not len(running):
+                break
+            values = self.run_round_batch(round, participants[running], condition, state)
+            if len(values) != len(running):
+                raise RuntimeError(f"run_round_batch() returned {len(values)} values for "
+                                   f"{len(running)} participants")
+            if typed:
+                rows[participants[running], round] = values
+            else:
+                for i, value in zip(running, values):
+                    results[i].append(value)
+            counts[running] = round + 1
+        if typed:
+            self.run_batch_finish(participants, condition,
+                                  [rows[p, :n] for p, n in zip(participants, counts)],
+                                  state)
+            return counts.tolist()
+        results = self.run_batch_finish(participants, condition, results, state)
+        if len(results) != len(participants):
+            raise RuntimeError(f"run_batch_finish() returned {len(results)} results for "
+                               f"{len(participants)} participants")
+        return results
+
+    def _attach_result_array(self):
+        # Called in a worker process that was spawned rather than forked.
+        shape = (len(self._conditions), self._participants, self._rounds)
+        if self._result_file:
+            self._result_array = np.lib.format.open_memmap(self._result_file, mode="r+")
+        else:
+            self._result_shm = SharedMemory(name=self._result_name)
+            self._result_array = np.ndarray(shape, self._result_dtype,
+                                            buffer=self._result_shm.buf)
+
+    def _allocate_results(self, keep):
+        if self._result_dtype is None:
+            return super()._allocate_results(keep)
+        self._results = dict.fromkeys(self._conditions) if keep else None
+        shape = (len(self._conditions), self._participants, self._rounds)
+        if self._journaling and not self._result_file:
+            raise RuntimeError("result_file must be supplied to use a journal with result_dtype")
+        if self._result_file and self._resuming and Path(self._result_file).exists():
+            self._result_array = np.lib.format.open_memmap(self._result_file, mode="r+")
+            if self._result_array.shape != shape or self._result_array.dtype != self._result_dtype:
+                raise RuntimeError(f"The existing {self._result_file} does not match this experiment")
+        elif self._result_file:
+            self._result_array = np.lib.format.open_memmap(self._result_file, mode="w+",
+                                                           dtype=self._result_dtype,
+                                                           shape=shape)
+        else:
+            # newly created shared memory is always zero filled
+            self._result_shm = SharedMemory(
+                create=True, size=max(1, self._result_dtype.itemsize * int(np.prod(shape))))
+            self._result_name = self._result_shm.name
+            self._result_array = np.ndarray(shape, self._result_dtype,
+                                            buffer=self._result_shm.buf)
+        self._round_counts = np.zeros(shape[:2], dtype=int)
+
+    def _received(self, participant, condition, result):
+        if self._result_dtype is None:
+            return result
+        i = self._condition_index[condition]
+        self._round_counts[i, participant] = result
+        return self._result_array[i, participant, :result]
+
+    def _retain(self, participant, condition, result):
+        if self._result_dtype is None:
+            super()._retain(participant, condition, result)
+
+    def _condition_results(self, condition):
+        if self._result_dtype is None:
+            return super()._condition_results(condition)
+        results = self._result_array[self._condition_index[condition]]
+        if condition in self._condition_sizes:
+            return results[:self._condition_extents[condition]]
+        return results
+
+    def _cache_value(self, participant, condition, result):
+        if self._result_dtype is None:
+            return result
+        i = self._condition_index[condition]
+        return result, self._result_array[i, participant, :result].copy()
+
+    def _from_cache(self, participant, condition, value):
+        if self._result_dtype is None:
+            return value
+        n, values = value
+        row = self._result_array[self._condition_index[condition], participant]
+        row[...] = 0
+        row[:n] = values
+        return n
+
+    def _release_results(self):
+        # The parent's mapping of the shared memory remains valid after it is unlinked,
+        # and is released when the result_array is no longer referenced.
+        if self._result_shm is not None:
+            self._result_shm.unlink()
+            self._result_name = None
+        elif self._result_array is not None:
+            self._result_array.flush()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,198 @@
+# Copyright (c) 2020-2022 Carnegie Mellon University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to the following
+# conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies
+# or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Benchmarks of Alhazen's own overhead, as opposed to that of the experiments it runs.
+
+Each benchmark is a synthetic :class:`Experiment` or :class:`IteratedExperiment` whose
+tasks do a known, small amount of work, run with each of several process counts. For
+each run the wall clock time, tasks per second, and the overhead per task, the time
+beyond that needed for the tasks' own work were it perfectly divided among the workers,
+are reported, along with the scaling efficiency relative to a single worker process.
+
+    python benchmark_alhazen.py --processes 1,2,4 --output bench_output.txt
+
+The results are printed as a table, and, if --output is supplied, also appended to that
+file as a single line of JSON, together with a description of the machine and versions
+used, so that runs with different versions of Alhazen can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+
+import alhazen
+from alhazen import Experiment, IteratedExperiment
+
+
+def spin(seconds):
+    # Busy waits for the given time, as a stand in for CPU bound work.
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class NoOp(Experiment):
+
+    def run_participant(self, participant, condition, context):
+        return participant
+
+
+class CPUBound(Experiment):
+
+    def prepare_experiment(self, work=0.001, **kwargs):
+        self.work = work
+
+    def run_participant(self, participant, condition, context):
+        spin(self.work)
+        return participant
+
+
+class LargeContext(Experiment):
+
+    def prepare_experiment(self, size=1 << 20, **kwargs):
+        self.size = size
+
+    def prepare_participant(self, participant, condition, context):
+        context["data"] = bytes(self.size)
+
+    def run_participant(self, participant, condition, context):
+        return len(context["data"])
+
+
+class LargeResult(Experiment):
+
+    def prepare_experiment(self, size=1 << 20, **kwargs):
+        self.size = size
+
+    def run_participant(self, participant, condition, context):
+        return bytearray(self.size)
+
+
+class HeavyLog(Experiment):
+
+    def prepare_experiment(self, rows=100, **kwargs):
+        self.rows = rows
+
+    def run_participant(self, participant, condition, context):
+        for i in range(self.rows):
+            self.log([participant, condition, i, i * 0.5, "row"])
+        return participant
+
+
+class Rounds(IteratedExperiment):
+
+    def run_participant_run(self, round, participant, condition, context):
+        return round
+
+
+# Each benchmark is the experiment class, the keyword arguments used to create it, those
+# passed to run(), and the time each task is expected to spend on its own work.
+BENCHMARKS = {
+    "noop": (NoOp, {}, {}, 0),
+    "cpu": (CPUBound, {}, {"work": 0.001}, 0.001),
+    "large_context": (LargeContext, {}, {"size": 1 << 20}, 0),
+    "large_result": (LargeResult, {}, {"size": 1 << 20}, 0),
+    "heavy_log": (HeavyLog, {"csv": True}, {"rows": 100}, 0),
+    "iterated": (Rounds, {"rounds": 100}, {}, 0),
+}
+
+
+def run_benchmark(name, process_count, participants, chunk_size, tempdir):
+    cls, kwargs, run_kwargs, work = BENCHMARKS[name]
+    kwargs = dict(kwargs)
+    if "csv" in kwargs:
+        kwargs["logfile"] = os.path.join(tempdir, f"{name}-{process_count}.csv")
+    exp = cls(participants=participants,
+              process_count=process_count,
+              chunk_size=chunk_size,
+              show_progress=False,
+              **kwargs)
+    start = time.perf_counter()
+    if exp.run(**run_kwargs) is None:
+        raise RuntimeError(f"The {name} benchmark failed")
+    wall = time.perf_counter() - start
+    if "logfile" in kwargs:
+        os.unlink(kwargs["logfile"])
+    return {"benchmark": name,
+            "process_count": exp.process_count,
+            "participants": participants,
+            "chunk_size": chunk_size,
+            "wall_time": wall,
+            "tasks_per_second": participants / wall,
+            "overhead_per_task": (wall * exp.process_count - participants * work) / participants}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Alhazen's overhead")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+                        help="comma separated names of the benchmarks to run, from "
+                             + ", ".join(BENCHMARKS))
+    parser.add_argument("--processes", default=f"1,{os.cpu_count() or 1}",
+                        help="comma separated process counts to run each benchmark with")
+    parser.add_argument("--participants", type=int, default=2000,
+                        help="the number of tasks in each benchmark run")
+    parser.add_argument("--chunk-size", default="1",
+                        help='the chunk_size to use, an integer or "auto"')
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="how many times to run each, keeping the fastest")
+    parser.add_argument("--output", help="a file to which to append the results as JSON")
+    args = parser.parse_args(argv)
+    names = args.benchmarks.split(",")
+    for n in names:
+        if n not in BENCHMARKS:
+            parser.error(f"unknown benchmark {n}")
+    process_counts = sorted({int(n) for n in args.processes.split(",")})
+    chunk_size = args.chunk_size if args.chunk_size == "auto" else int(args.chunk_size)
+    results = []
+    with TemporaryDirectory(prefix="alhazen-bench-") as tempdir:
+        for name in names:
+            baseline = None
+            for n in process_counts:
+                r = min((run_benchmark(name, n, args.participants, chunk_size, tempdir)
+                         for _ in range(args.repeat)),
+                        key=lambda r: r["wall_time"])
+                if baseline is None:
+                    baseline = r
+                r["speedup"] = baseline["wall_time"] / r["wall_time"]
+                r["scaling_efficiency"] = (r["speedup"] * baseline["process_count"]
+                                           / r["process_count"])
+                results.append(r)
+                print(f"{name:>14} {r['process_count']:>3} processes: "
+                      f"{r['tasks_per_second']:>10.1f} tasks/s, "
+                      f"{r['overhead_per_task'] * 1e6:>9.1f} µs overhead/task, "
+                      f"efficiency {r['scaling_efficiency']:.2f}")
+    if args.output:
+        with open(args.output, "a") as f:
+            json.dump({"alhazen_version": alhazen.__version__,
+                       "python_version": platform.python_version(),
+                       "platform": platform.platform(),
+                       "cpu_count": os.cpu_count(),
+                       "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                       "results": results},
+                      f)
+            f.write("\n")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -17,13 +17,23 @@
 # CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE
 # OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import asyncio
+import gzip
 from collections import defaultdict
 from itertools import count
+import json
 import math
+import multiprocessing.util
+import os
+import pstats
 from multiprocessing import current_process
-from pytest import raises
+from pytest import importorskip, raises
 import random
+import socket
 import statistics
+import subprocess
+import sys
+import threading
 import time
 
 from alhazen import *
@@ -255,3 +265,902 @@ def test__log(tmp_path):
     LogTest(show_progress=False, logfile=p, csv="dict", fieldnames=("stuff",)).run()
     with open(p) as f:
         assert f.read() == "stuff\npe\npc\npp\nfp\nfc\nfe\nsetup\nrpp\nrpc\nrpr\nrpf\n"
+
+
+class Ordered(Experiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.finished = list()
+
+    def run_participant(self, participant, condition, context):
+        return (participant, condition)
+
+    def finish_participant(self, participant, condition, result):
+        assert result == (participant, condition)
+        return participant * 10
+
+    def finish_condition(self, condition, results):
+        self.finished.append(condition)
+        return results
+
+
+def test_chunking():
+    with raises(ValueError):
+        Ordered(chunk_size=0)
+    with raises(ValueError):
+        Ordered(chunk_size="big")
+    for chunk_size in (1, 7, 1000, "auto"):
+        exp = Ordered(participants=100, conditions="abcd", process_count=3,
+                      chunk_size=chunk_size, show_progress=False)
+        assert exp.chunk_size == chunk_size
+        results = exp.run()
+        assert sorted(exp.finished) == list("abcd")
+        for c in "abcd":
+            assert results[c] == [p * 10 for p in range(100)]
+
+
+def test_run_iter():
+    exp = Ordered(participants=50, conditions="xyz", process_count=2, chunk_size=4,
+                  show_progress=False)
+    seen = set()
+    for c, p, r in exp.run_iter():
+        assert r == p * 10
+        seen.add((c, p))
+    assert seen == {(c, p) for c in "xyz" for p in range(50)}
+    assert exp.finished == []
+    assert exp._results is None
+    with raises(RuntimeError):
+        list(exp.run_iter())
+    exp = Ordered(participants=50, process_count=2, show_progress=False)
+    for c, p, r in exp.run_iter():
+        assert c is None
+        break
+
+
+class SlowExit(Experiment):
+
+    def setup(self):
+        multiprocessing.util.Finalize(None, time.sleep, args=(1,), exitpriority=0)
+
+    def run_participant(self, participant, condition, context):
+        return participant
+
+
+def test_run_async():
+    async def both():
+        first = Ordered(participants=30, conditions="ab", process_count=2,
+                        chunk_size=4, show_progress=False)
+        second = Ordered(participants=20, process_count=2, show_progress=False)
+        return await asyncio.gather(first.run_async(), second.run_async())
+    first, second = asyncio.run(both())
+    assert first == {c: [p * 10 for p in range(30)] for c in "ab"}
+    assert second == [p * 10 for p in range(20)]
+    async def iterate():
+        exp = Ordered(participants=25, conditions="xy", process_count=2,
+                      show_progress=False)
+        return {(c, p): r async for c, p, r in exp.run_async_iter()}
+    assert asyncio.run(iterate()) == {(c, p): p * 10 for c in "xy" for p in range(25)}
+    async def cancel():
+        exp = Ordered(participants=10000, process_count=2, show_progress=False)
+        task = asyncio.create_task(exp.run_async())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with raises(asyncio.CancelledError):
+            await task
+        return exp
+    async def heartbeat():
+        # joining the workers, which here take a while to exit, does not block the loop
+        exp = SlowExit(participants=4, process_count=2, show_progress=False)
+        task = asyncio.create_task(exp.run_async())
+        gap = 0
+        last = time.monotonic()
+        while not task.done():
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            gap = max(gap, now - last)
+            last = now
+        return await task, gap
+    results, gap = asyncio.run(heartbeat())
+    assert results == [0, 1, 2, 3]
+    assert gap < 0.5
+    exp = asyncio.run(cancel())
+    assert exp._workers
+    for w in exp._workers:
+        w.process.join(10)
+        assert not w.process.is_alive()
+
+
+class Scheduled(Experiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.order = []
+
+    def prepare_participant(self, participant, condition, context):
+        self.order.append((participant, condition))
+
+    def run_participant(self, participant, condition, context):
+        time.sleep(condition)
+        return participant
+
+
+class Costed(Scheduled):
+
+    def task_cost(self, participant, condition):
+        return condition * 10 + participant % 3
+
+
+def test_schedule():
+    with raises(ValueError):
+        Scheduled(schedule="random")
+    exp = Scheduled(participants=4, conditions=(0, 0.001), process_count=2,
+                    show_progress=False)
+    assert exp.schedule == "condition"
+    exp.run()
+    assert exp.order == [(p, c) for c in (0, 0.001) for p in range(4)]
+    exp = Scheduled(participants=4, conditions=(0, 0.001, 0.002), process_count=2,
+                    chunk_size=2, schedule="interleave", show_progress=False)
+    assert exp.run() == {c: list(range(4)) for c in (0, 0.001, 0.002)}
+    assert exp.order == [(p, c) for p in range(4) for c in (0, 0.001, 0.002)]
+    exp = Costed(participants=6, conditions=(0, 0.002), process_count=2,
+                 schedule="longest_first", show_progress=False)
+    assert exp.run() == {c: list(range(6)) for c in (0, 0.002)}
+    assert exp.order == sorted(exp.order, key=lambda t: (-exp.task_cost(*t), t[1], t[0]))
+    assert exp.order[0] == (2, 0.002)
+    # without costs the slower condition is run first once both have been timed
+    exp = Scheduled(participants=10, conditions=(0.01, 0.05), process_count=1,
+                    schedule="longest_first", show_progress=False)
+    assert exp.run() == {c: list(range(10)) for c in (0.01, 0.05)}
+    assert exp.order[:2] == [(0, 0.01), (0, 0.05)]
+    assert exp.order.index((9, 0.05)) < exp.order.index((9, 0.01))
+
+
+class Noisy(Experiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.finished = dict()
+
+    def run_participant(self, participant, condition, context):
+        return random.Random(self.task_seed(participant, condition)).gauss(0, condition)
+
+    def finish_condition(self, condition, results):
+        self.finished[condition] = len(results)
+        return results
+
+
+def test_precision():
+    with raises(ValueError):
+        Noisy(precision=0)
+    with raises(ValueError):
+        Noisy(precision=0.5, min_participants=1)
+    with raises(ValueError):
+        Noisy(precision=0.5, confidence=1)
+    with raises(RuntimeError):
+        Noisy(precision=0.5, reduce=True)
+    for schedule in ("condition", "interleave", "longest_first"):
+        exp = Noisy(participants=200, conditions=(0.1, 10, 0.5), process_count=2,
+                    precision=0.5, schedule=schedule, show_progress=False)
+        assert exp.participant_counts is None
+        results = exp.run()
+        counts = exp.participant_counts
+        assert 10 <= counts[0.1] < 30
+        assert counts[10] == 200
+        assert 10 <= counts[0.5] < 50
+        for c in exp.conditions:
+            assert exp.finished[c] == len(results[c]) == counts[c]
+            assert None not in results[c]
+    # with nothing in flight when a condition stops, exactly min_participants are run
+    exp = Noisy(participants=200, conditions=(0.1, 10), process_count=1, in_flight=1,
+                precision=0.5, min_participants=40, show_progress=False)
+    assert {c: len(r) for c, r in exp.run().items()} == {0.1: 40, 10: 200}
+
+
+class Summing(IteratedExperiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.finished = dict()
+
+    def run_participant_run(self, round, participant, condition, context):
+        return participant * condition + round
+
+    def reduce_init(self, condition):
+        return [0, [0] * self.rounds]
+
+    def reduce_accumulate(self, partial, participant, condition, result):
+        partial[0] += 1
+        for i, r in enumerate(result):
+            partial[1][i] += r
+        return partial
+
+    def reduce_merge(self, partial, other):
+        return [partial[0] + other[0], [a + b for a, b in zip(partial[1], other[1])]]
+
+    def reduce_finalize(self, condition, partial):
+        return [s / partial[0] for s in partial[1]]
+
+    def finish_condition(self, condition, result):
+        self.finished[condition] = result
+        return result
+
+
+def test_reduce():
+    expected = {c: [c * 99 / 2 + r for r in range(5)] for c in (1, 2, 3)}
+    for chunk_size in (1, 6, "auto"):
+        exp = Summing(participants=100, rounds=5, conditions=(1, 2, 3), process_count=3,
+                      chunk_size=chunk_size, reduce=True, show_progress=False)
+        assert exp.run() == expected
+        assert exp.finished == expected
+    exp = Summing(participants=100, rounds=5, conditions=(1, 2, 3), process_count=3,
+                  chunk_size=8, reduce=True, show_progress=False)
+    assert {c: r for c, p, r in exp.run_iter()} == expected
+    assert exp.finished == {}
+
+
+class Typed(IteratedExperiment):
+
+    def run_participant_continue(self, round, participant, condition, context):
+        return participant % 3 or round < 4
+
+    def run_participant_run(self, round, participant, condition, context):
+        return participant * condition + round / 10
+
+
+def test_result_dtype(tmp_path):
+    numpy = importorskip("numpy")
+    def check(exp, results):
+        assert exp.result_array.shape == (2, 30, 8)
+        assert results[1.0] is not None
+        for i, c in enumerate(exp.conditions):
+            assert results[c].shape == (30, 8)
+            for p in range(30):
+                n = 8 if p % 3 else 4
+                assert exp.round_counts[i, p] == n
+                assert list(results[c][p]) == ([p * c + r / 10 for r in range(n)]
+                                               + [0] * (8 - n))
+    exp = Typed(participants=30, rounds=8, conditions=(1.0, 2.0), process_count=2,
+                chunk_size=4, result_dtype="float64", show_progress=False)
+    assert exp.result_array is None
+    check(exp, exp.run())
+    p = tmp_path / "results.npy"
+    exp = Typed(participants=30, rounds=8, conditions=(1.0, 2.0), process_count=2,
+                result_dtype=float, result_file=p, show_progress=False)
+    results = exp.run()
+    check(exp, results)
+    assert (numpy.load(p) == exp.result_array).all()
+    with raises(RuntimeError):
+        Typed(result_dtype=int, reduce=True)
+
+
+class Lockstep(Typed):
+
+    def run_batch_prepare(self, participants, condition, contexts):
+        return {"blocks": len(participants)}
+
+    def run_batch_continue(self, round, participants, condition, state):
+        return (participants % 3 != 0) | (round < 4)
+
+    def run_round_batch(self, round, participants, condition, state):
+        return participants * condition + round / 10
+
+    def run_batch_finish(self, participants, condition, results, state):
+        assert state["blocks"] == len(participants) == len(results)
+        return [list(r) for r in results]
+
+
+def test_lockstep():
+    numpy = importorskip("numpy")
+    expected = Typed(participants=30, rounds=8, conditions=(1.0, 2.0), process_count=2,
+                     show_progress=False).run()
+    for chunk_size in (1, 7, "auto"):
+        exp = Lockstep(participants=30, rounds=8, conditions=(1.0, 2.0), process_count=2,
+                       chunk_size=chunk_size, lockstep=True, show_progress=False)
+        assert exp.lockstep
+        assert exp.run() == expected
+    exp = Lockstep(participants=30, rounds=8, conditions=(1.0, 2.0), process_count=2,
+                   chunk_size=10, lockstep=True, result_dtype=float, show_progress=False)
+    results = exp.run()
+    for i, c in enumerate(exp.conditions):
+        for p in range(30):
+            assert exp.round_counts[i, p] == len(expected[c][p])
+            assert list(results[c][p][:len(expected[c][p])]) == expected[c][p]
+    assert Lockstep(lockstep=True).chunk_size == "auto"
+    assert Lockstep().chunk_size == 1
+    with raises(RuntimeError):
+        Lockstep(lockstep=True, ordered_log=True, logfile="log.txt")
+    with raises(NotImplementedError):
+        IteratedExperiment(lockstep=True).run_round_batch(0, numpy.arange(3), None, None)
+
+
+class BigResults(Experiment):
+
+    def run_participant(self, participant, condition, context):
+        import numpy
+        return (participant, numpy.full(100_000, participant, dtype=numpy.int32),
+                numpy.arange(10))
+
+
+def test_result_buffer_threshold():
+    numpy = importorskip("numpy")
+    with raises(ValueError):
+        BigResults(result_buffer_threshold=0)
+    for threshold in (None, 1000):
+        exp = BigResults(participants=20, process_count=2, chunk_size=3,
+                         result_buffer_threshold=threshold, show_progress=False)
+        for p, (q, big, small) in enumerate(exp.run()):
+            assert p == q
+            assert big.shape == (100_000,) and (big == p).all()
+            assert (small == numpy.arange(10)).all()
+            big[0] = -1
+            assert big[0] == -1
+
+
+class Dying(Experiment):
+
+    def run_participant(self, participant, condition, context):
+        if participant == 7:
+            if condition == "exit":
+                os._exit(3)
+            raise ValueError("failed")
+        return participant
+
+
+def test_worker_failure():
+    for c in ("exit", "raise"):
+        start = time.time()
+        assert Dying(participants=20, conditions=[c], process_count=2,
+                     show_progress=False).run() is None
+        assert time.time() - start < 5
+
+
+class Windowed(Experiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+    def prepare_participant(self, participant, condition, context):
+        self.outstanding += 1
+        self.max_outstanding = max(self.max_outstanding, self.outstanding)
+
+    def run_participant(self, participant, condition, context):
+        time.sleep(0.001)
+        return participant
+
+    def finish_participant(self, participant, condition, result):
+        self.outstanding -= 1
+        return result
+
+
+def test_in_flight():
+    with raises(ValueError):
+        Windowed(in_flight=0)
+    for in_flight, chunk_size in ((1, 1), (2, 1), (3, 5)):
+        exp = Windowed(participants=200, process_count=2, in_flight=in_flight,
+                       chunk_size=chunk_size, show_progress=False)
+        assert exp.run() == list(range(200))
+        assert exp.max_outstanding <= 2 * in_flight * chunk_size
+
+
+class BinaryLogging(IteratedExperiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.log(("start", -1, -1, 0.0))
+
+    def run_participant_run(self, round, participant, condition, context):
+        if round % 2:
+            self.log({"condition": condition, "participant": participant,
+                      "round": round, "value": participant + round / 10})
+        else:
+            self.log([condition, participant, round, participant + round / 10])
+
+
+def test_binary_log(tmp_path):
+    numpy = importorskip("numpy")
+    with raises(RuntimeError):
+        BinaryLogging(fieldnames=["a", "b"], fieldtypes=[int])
+    p = tmp_path / "log.npy"
+    BinaryLogging(participants=300, rounds=50, conditions=("a", "bb"), process_count=2,
+                  chunk_size=7, logfile=p,
+                  fieldnames=("condition", "participant", "round", "value"),
+                  fieldtypes=("U5", int, int, float),
+                  show_progress=False).run()
+    log = numpy.load(p)
+    assert len(log) == 2 * 300 * 50 + 1
+    assert log[0].tolist() == ("start", -1, -1, 0.0)
+    rows = sorted(log[1:].tolist())
+    assert rows == sorted((c, p, r, p + r / 10)
+                          for c in ("a", "bb") for p in range(300) for r in range(50))
+    csv_path = tmp_path / "log.csv"
+    log_to_csv(p, csv_path)
+    with open(csv_path) as f:
+        lines = f.readlines()
+    assert len(lines) == 2 * 300 * 50 + 2
+    assert lines[0] == "condition,participant,round,value\n"
+    assert lines[1] == "start,-1,-1,0.0\n"
+
+
+class OrderedLogging(IteratedExperiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.log(["start"] if self._csv else "start")
+
+    def setup(self):
+        self.log(["setup"] if self._csv else "setup")
+
+    def run_participant_prepare(self, participant, condition, context):
+        if random.random() < 0.05:
+            time.sleep(0.01)
+
+    def run_participant_run(self, round, participant, condition, context):
+        if self._csv:
+            self.log([condition, participant, round])
+        else:
+            self.log(condition, participant, round)
+
+
+def test_ordered_log(tmp_path):
+    path = tmp_path / "log.txt"
+    for csv, sep in ((None, " "), (True, ",")):
+        expected = [f"{c}{sep}{p}{sep}{r}\n" for c in "ba" for p in range(40) for r in range(3)]
+        for ordered in (False, True):
+            OrderedLogging(participants=40, rounds=3, conditions="ba", process_count=3,
+                           chunk_size=3, logfile=path, csv=csv, ordered_log=ordered,
+                           fieldnames=["c", "p", "r"], show_progress=False).run()
+            with open(path) as f:
+                lines = f.readlines()
+            assert lines[0] == "c,p,r\n"
+            assert lines[1] == "start\n"
+            if ordered:
+                assert lines[2:5] == ["setup\n"] * 3
+                assert lines[5:] == expected
+            else:
+                assert sorted(lines[2:]) == sorted(["setup\n"] * 3 + expected)
+
+
+def test_ordered_binary_log(tmp_path):
+    numpy = importorskip("numpy")
+    p = tmp_path / "log.npy"
+    OrderedLogging(participants=300, rounds=40, conditions=(3, 1, 2), process_count=3,
+                   chunk_size="auto", logfile=p, csv=True, ordered_log=True,
+                   fieldnames=["c", "p", "r"], fieldtypes=[int, int, int],
+                   show_progress=False).run()
+    log = numpy.load(p)
+    assert log.tolist() == [(c, p, r) for c in (3, 1, 2) for p in range(300) for r in range(40)]
+
+
+def test_log_compression(tmp_path):
+    import gzip, lzma
+    with raises(ValueError):
+        OrderedLogging(log_compression="zip")
+    with raises(RuntimeError):
+        OrderedLogging(log_compression="gzip", ordered_log=True)
+    expected = sorted(["c,p,r\n", "start\n"] + ["setup\n"] * 3
+                      + [f"{c},{p},{r}\n" for c in "xy" for p in range(100) for r in range(5)])
+    for compression, opener in (("gzip", gzip.open), ("lzma", lzma.open)):
+        path = tmp_path / f"log.{compression}"
+        OrderedLogging(participants=100, rounds=5, conditions="xy", process_count=3,
+                       chunk_size=4, logfile=path, csv=True, log_compression=compression,
+                       fieldnames=["c", "p", "r"], show_progress=False).run()
+        with opener(path, "rt") as f:
+            lines = f.readlines()
+        assert lines[:2] == ["c,p,r\n", "start\n"]
+        assert sorted(lines) == expected
+
+
+def test_merge_logs_in_kernel(tmp_path, monkeypatch):
+    # the workers' logs should be appended to the main one without reading them into
+    # Python, whenever the platform allows it
+    if not (hasattr(os, "copy_file_range") or hasattr(os, "sendfile")):
+        return
+    copied = []
+    def counting(function):
+        def wrapper(*args):
+            n = function(*args)
+            copied.append(n)
+            return n
+        return wrapper
+    for name in ("copy_file_range", "sendfile"):
+        if hasattr(os, name):
+            monkeypatch.setattr(os, name, counting(getattr(os, name)))
+    path = tmp_path / "log.csv"
+    for compression in (None, "gzip"):
+        copied.clear()
+        OrderedLogging(participants=40, rounds=3, conditions="ba", process_count=3,
+                       logfile=path, csv=True, log_compression=compression,
+                       show_progress=False).run()
+        if compression is None:
+            # all but what the control process itself wrote
+            assert sum(copied) == os.path.getsize(path) - len(b"start\r\n")
+        else:
+            assert sum(copied) > 0
+    with open(path, "rb") as f:
+        assert gzip.decompress(f.read()).count(b"\n") == 1 + 3 + 40 * 3 * 2
+
+
+class Interrupted(IteratedExperiment):
+
+    def prepare_experiment(self, fail=False):
+        self.fail = fail
+        self.finished = set()
+
+    def run_participant_run(self, round, participant, condition, context):
+        if self.fail and participant == 70 and condition == "b":
+            raise RuntimeError("interrupted")
+        self.log([condition, participant, round])
+        return participant + round
+
+    def finish_participant(self, participant, condition, result):
+        self.finished.add((participant, condition))
+        return result
+
+
+def test_journal(tmp_path):
+    journal = tmp_path / "journal"
+    log = tmp_path / "log.csv"
+    kwargs = dict(participants=100, rounds=3, conditions="ab", process_count=2,
+                  chunk_size=4, logfile=log, csv=True, fieldnames=["c", "p", "r"],
+                  ordered_log=True, show_progress=False)
+    assert Interrupted(journal=journal, **kwargs).run(fail=True) is None
+    for i in range(2):
+        exp = Interrupted(**kwargs)
+        results = exp.run(resume=journal)
+        assert exp.finished == {(p, c) for p in range(100) for c in "ab"}
+        assert results == {c: [[p, p + 1, p + 2] for p in range(100)] for c in "ab"}
+        with open(log) as f:
+            assert f.readlines() == (["c,p,r\n"] + [f"{c},{p},{r}\n" for c in "ab"
+                                                    for p in range(100) for r in range(3)])
+    exp = Interrupted(journal=journal, **kwargs)
+    assert exp.run(fail=True) is None
+    assert len(exp.finished) < 200
+
+
+def test_journal_typed(tmp_path):
+    importorskip("numpy")
+    journal = tmp_path / "journal"
+    kwargs = dict(participants=100, rounds=3, conditions="ab", process_count=2,
+                  result_dtype=int, result_file=tmp_path / "results.npy", show_progress=False)
+    assert Interrupted(participants=2, result_dtype=int, journal=journal,
+                       show_progress=False).run() is None
+    assert Interrupted(journal=journal, **kwargs).run(fail=True) is None
+    results = Interrupted(**kwargs).run(resume=journal)
+    for c in "ab":
+        assert results[c].tolist() == [[p, p + 1, p + 2] for p in range(100)]
+
+
+class Flaky(Experiment):
+
+    def prepare_experiment(self, directory=None, always=False):
+        self.directory = directory
+        self.always = always
+
+    def run_participant(self, participant, condition, context):
+        if participant in (3, 7):
+            marker = self.directory / f"{participant}"
+            if self.always or not marker.exists():
+                marker.touch()
+                if participant == 7:
+                    os._exit(3)
+                raise ValueError("flaky")
+        return participant
+
+
+def test_retries(tmp_path):
+    with raises(ValueError):
+        Flaky(retries=-1)
+    for chunk_size in (1, 5):
+        directory = tmp_path / f"{chunk_size}"
+        directory.mkdir()
+        exp = Flaky(participants=30, process_count=2, chunk_size=chunk_size, retries=1,
+                    show_progress=False)
+        assert exp.run(directory=directory) == list(range(30))
+    exp = Flaky(participants=30, process_count=2, retries=2, show_progress=False)
+    assert exp.run(directory=tmp_path, always=True) is None
+
+
+class IdleExit(Experiment):
+
+    def prepare_experiment(self, directory=None):
+        self.directory = directory
+
+    def run_participant(self, participant, condition, context):
+        if participant == 1:
+            marker = self.directory / "1"
+            if not marker.exists():
+                marker.touch()
+                # exit once the result has been sent, and there is nothing left to run
+                threading.Timer(0.3, os._exit, (3,)).start()
+        else:
+            time.sleep(0.6)
+        return participant
+
+
+def test_idle_worker_exit(tmp_path):
+    exp = IdleExit(participants=2, process_count=2, in_flight=1, show_progress=False)
+    assert exp.run(directory=tmp_path) == [0, 1]
+
+
+class Straggling(Experiment):
+
+    def prepare_experiment(self, directory=None):
+        self.directory = directory
+
+    def run_participant(self, participant, condition, context):
+        if participant == 5:
+            marker = self.directory / "5"
+            if not marker.exists():
+                marker.touch()
+                time.sleep(30)
+        return participant
+
+    def participant_failed(self, participant, condition, description):
+        assert "timed out" in description
+        return None
+
+
+def test_task_timeout(tmp_path):
+    with raises(ValueError):
+        Straggling(task_timeout=0)
+    exp = Straggling(participants=10, process_count=2, task_timeout=1, retries=1,
+                     show_progress=False)
+    start = time.time()
+    assert exp.run(directory=tmp_path) == list(range(10))
+    assert time.time() - start < 20
+    (tmp_path / "again").mkdir()
+    exp = Straggling(participants=10, process_count=2, task_timeout=0.5,
+                     show_progress=False)
+    start = time.time()
+    assert exp.run(directory=tmp_path / "again") == [0, 1, 2, 3, 4, None, 6, 7, 8, 9]
+    assert time.time() - start < 20
+
+
+class SlowSetup(Experiment):
+
+    def setup(self):
+        time.sleep(1)
+
+    def run_participant(self, participant, condition, context):
+        time.sleep(0.05)
+        return participant
+
+
+def test_slow_setup_timeout():
+    # the time taken by setup() does not count against the first chunk
+    exp = SlowSetup(participants=8, process_count=2, task_timeout=0.5,
+                    show_progress=False)
+    assert exp.run() == list(range(8))
+
+
+def test_speculative(tmp_path):
+    exp = Straggling(participants=20, process_count=2, speculative=True,
+                     show_progress=False)
+    start = time.time()
+    assert exp.run(directory=tmp_path) == list(range(20))
+    assert time.time() - start < 20
+
+
+def test_instrument(tmp_path):
+    exp = Ordered(participants=40, conditions=range(3), process_count=2, chunk_size=4,
+                  show_progress=False)
+    exp.run()
+    assert exp.instrumentation is None
+    with raises(RuntimeError):
+        exp.write_trace(tmp_path / "trace.json")
+    exp = Ordered(participants=40, conditions=range(3), process_count=2, chunk_size=4,
+                  instrument=True, show_progress=False)
+    assert exp.instrumentation is None
+    exp.run()
+    stats = exp.instrumentation
+    assert stats["tasks"] == 120
+    assert stats["chunks"] == 30
+    assert stats["task_time"]["count"] == 120
+    assert stats["queue_wait"]["total"] >= 0
+    assert stats["bytes_sent"]["total"] > 0 and stats["bytes_received"]["total"] > 0
+    assert sum(w["tasks"] for w in stats["workers"].values()) == 120
+    assert all(0 < w["utilization"] <= 1 for w in stats["workers"].values())
+    assert {"prepare", "wait", "receive", "complete"} <= set(stats["controller"])
+    assert stats["wall_time"] >= stats["task_time"]["max"]
+    exp.write_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as f:
+        trace = json.load(f)
+    tasks = [e for e in trace["traceEvents"] if e.get("cat") == "task"]
+    assert len(tasks) == 120
+    assert all(e["dur"] >= 0 for e in tasks)
+
+
+class Unprofiled(Experiment):
+
+    def run_participant(self, participant, condition, context):
+        if hasattr(sys, "monitoring"):
+            return sys.monitoring.get_tool(sys.monitoring.PROFILER_ID) is not None
+        return sys.getprofile() is not None
+
+
+def test_profile(tmp_path):
+    exp = Ordered(participants=20, conditions=range(3), process_count=2,
+                  profile=tmp_path / "workers.prof",
+                  controller_profile=tmp_path / "controller.prof",
+                  show_progress=False)
+    exp.run()
+    stats = pstats.Stats(str(tmp_path / "workers.prof"))
+    assert any(f[2] == "run_participant" and stats.stats[f][0] == 60
+               for f in stats.stats)
+    stats = pstats.Stats(str(tmp_path / "controller.prof"))
+    assert any(f[2] == "finish_participant" and stats.stats[f][0] == 60
+               for f in stats.stats)
+    # workers do not inherit the control process's profiler
+    exp = Unprofiled(participants=4, process_count=2,
+                     controller_profile=tmp_path / "alone.prof", show_progress=False)
+    assert exp.run() == [False] * 4
+
+
+class Cached(Experiment):
+
+    def prepare_experiment(self, runs=None):
+        self.runs = runs
+
+    def run_participant(self, participant, condition, context):
+        (self.runs / f"{participant}-{condition}-{os.urandom(8).hex()}").touch()
+        return (participant, condition, random.random())
+
+
+def test_cache(tmp_path):
+    runs = tmp_path / "runs"
+    runs.mkdir()
+    cache = tmp_path / "cache"
+    exp = Cached(participants=10, conditions=[1, 2], process_count=2, cache=cache,
+                 show_progress=False)
+    first = exp.run(runs=runs)
+    assert len(list(runs.iterdir())) == 20
+    exp = Cached(participants=10, conditions=[1, 2, 3], process_count=2, cache=cache,
+                 show_progress=False)
+    second = exp.run(runs=runs)
+    assert len(list(runs.iterdir())) == 30
+    assert second[1] == first[1] and second[2] == first[2]
+    assert [r[:2] for r in second[3]] == [(p, 3) for p in range(10)]
+    # the same seeds give the same results even when not served from the cache
+    exp = Cached(participants=10, conditions=[1, 2], process_count=2, cache=cache,
+                 cache_version="2", show_progress=False)
+    assert exp.run(runs=runs) == first
+    assert len(list(runs.iterdir())) == 50
+    importorskip("numpy")
+    for _ in range(2):
+        exp = Typed(participants=30, rounds=8, conditions=(1.0, 2.0), process_count=2,
+                    result_dtype="float64", cache=cache, show_progress=False)
+        results = exp.run()
+        assert list(exp.round_counts[0, :4]) == [4, 8, 8, 4]
+        assert list(results[2.0][2]) == [4 + r / 10 for r in range(8)]
+
+
+class Publishing(Experiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.publish("offset", 1000)
+
+    def prepare_condition(self, condition, context):
+        import numpy
+        self.publish(f"table-{condition}", {"condition": condition,
+                                            "table": numpy.arange(100_000) * condition})
+        with raises(RuntimeError):
+            self.publish(f"table-{condition}", None)
+
+    def run_participant(self, participant, condition, context):
+        with raises(KeyError):
+            self.published("missing")
+        d = self.published(f"table-{condition}")
+        assert not d["table"].flags.writeable
+        return (os.getpid(), id(d),
+                int(d["table"][participant]) + self.published("offset"))
+
+
+def test_publish():
+    importorskip("numpy")
+    exp = Publishing(participants=20, conditions=(1, 2), process_count=2,
+                     show_progress=False)
+    with raises(RuntimeError):
+        exp.publish("early", 1)
+    results = exp.run()
+    for c in (1, 2):
+        assert [r[2] for r in results[c]] == [p * c + 1000 for p in range(20)]
+        # each worker unpickles each published object just once
+        assert len({r[:2] for r in results[c]}) == len({r[0] for r in results[c]})
+
+
+class BigContexts(Experiment):
+
+    def prepare_condition(self, condition, context):
+        context["big"] = bytes(1 << 20)
+        context["condition"] = condition
+        context["doomed"] = True
+
+    def prepare_participant(self, participant, condition, context):
+        context["participant"] = participant
+        context["condition"] = condition * 10
+        del context["doomed"]
+
+    def run_participant(self, participant, condition, context):
+        assert len(context["big"]) == 1 << 20
+        assert "doomed" not in context
+        return (context["participant"], context["condition"])
+
+
+def test_condition_contexts():
+    exp = BigContexts(participants=40, conditions=(1, 2, 3), process_count=2,
+                      instrument=True, show_progress=False)
+    results = exp.run()
+    for c in (1, 2, 3):
+        assert results[c] == [(p, c * 10) for p in range(40)]
+    # each condition's context is sent to each worker at most once
+    assert exp.instrumentation["bytes_sent"]["total"] < 7 * (1 << 20)
+
+
+class Shared(Experiment):
+
+    def prepare_experiment(self, **kwargs):
+        self.tables = dict()
+
+    def prepare_condition(self, condition, context):
+        context["table"] = self.tables[condition] = [condition] * 1000
+
+    def run_participant(self, participant, condition, context):
+        return context["table"]
+
+    def finish_participant(self, participant, condition, result):
+        return result is self.tables[condition]
+
+
+def test_executor(tmp_path):
+    with raises(ValueError):
+        Ordered(executor="fork")
+    with raises(RuntimeError):
+        Ordered(executor="thread", task_timeout=1)
+    path = tmp_path / "log.txt"
+    expected = [f"{c},{p},{r}\n" for c in "ba" for p in range(40) for r in range(3)]
+    for executor in ("thread", "inline"):
+        exp = Ordered(participants=20, conditions=(1, 2), process_count=3,
+                      chunk_size=3, executor=executor, show_progress=False)
+        assert exp.run() == {c: [p * 10 for p in range(20)] for c in (1, 2)}
+        exp = Summing(participants=30, rounds=4, conditions=(1, 2), reduce=True,
+                      executor=executor, show_progress=False)
+        results = exp.run()
+        assert results[2] == [29 + r for r in range(4)]
+        OrderedLogging(participants=40, rounds=3, conditions="ba", process_count=3,
+                       chunk_size=3, logfile=path, csv=True, ordered_log=True,
+                       executor=executor, show_progress=False).run()
+        with open(path) as f:
+            lines = f.readlines()
+        n = 3 if executor == "thread" else 1
+        assert lines == ["start\n"] + ["setup\n"] * n + expected
+        # tasks and results are passed to and from threads without being copied
+        exp = Shared(participants=6, conditions=(1, 2), process_count=2,
+                     executor=executor, show_progress=False)
+        assert exp.run() == {c: [True] * 6 for c in (1, 2)}
+
+
+def test_remote(tmp_path):
+    with raises(RuntimeError):
+        Ordered(executor="remote", address="localhost:1")
+    with raises(ValueError):
+        Ordered(executor="remote", address="localhost", authkey="secret")
+    def agents(processes):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        agent = subprocess.Popen([sys.executable, "-m", "alhazen", "worker",
+                                  f"127.0.0.1:{port}", "--processes", str(processes)],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 env=dict(os.environ, ALHAZEN_AUTHKEY="secret"))
+        return f"127.0.0.1:{port}", agent
+    address, agent = agents(2)
+    exp = Ordered(participants=20, conditions=(1, 2), chunk_size=3, executor="remote",
+                  address=address, authkey="secret", show_progress=False)
+    assert exp.run() == {c: [p * 10 for p in range(20)] for c in (1, 2)}
+    assert agent.wait(30) == 0
+    address, agent = agents(3)
+    path = tmp_path / "log.txt"
+    OrderedLogging(participants=40, rounds=3, conditions="ba", chunk_size=3,
+                   logfile=path, csv=True, ordered_log=True, executor="remote",
+                   address=address, authkey=b"secret", show_progress=False).run()
+    assert agent.wait(30) == 0
+    with open(path) as f:
+        lines = f.readlines()
+    assert lines == (["start\n"] + ["setup\n"] * 3
+                     + [f"{c},{p},{r}\n" for c in "ba" for p in range(40) for r in range(3)])